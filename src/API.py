@@ -2,25 +2,85 @@ import json
 import logging
 import re
 
+from hashlib import sha256
 from logging import Logger
 from requests import codes, Response, Session
-from time import sleep
+from time import perf_counter, sleep
 from traceback import format_exc
-from typing import Any, Callable, Dict, Optional
-
-from selenium.webdriver.chrome.webdriver import WebDriver
+from typing import Any, Callable, Dict, Optional, TYPE_CHECKING
+from urllib.parse import urlsplit
 
 from config import Config
+from deadline import Deadline, Hedger, request_timeout
+from tracing import traced
+
+if TYPE_CHECKING:
+    from selenium.webdriver.chrome.webdriver import WebDriver
+
 
+_card_types: Dict[str, str] = {}
+_discard_limit = 16384
+_keep_connection_limit = 32768
 
+
+def send_request(
+    hedger: Optional[Hedger],
+    operation: str,
+    send: Callable[[], Response]
+) -> Response:
+    if hedger is None:
+        return send()
+    return hedger.request(operation, send)
+
+
+def discard_body(response: Response, keep_connection: bool = False) -> None:
+    # A large remainder is cheaper to skip by closing the connection; a small one is cheaper to drain than a new TLS
+    # handshake. When the host is needed again shortly, a remainder up to a larger limit is still worth draining.
+    if response.raw is None:
+        return
+    limit = _keep_connection_limit if keep_connection else _discard_limit
+    remaining = response.raw.length_remaining
+    if remaining is not None and remaining <= limit:
+        response.raw.drain_conn()
+    elif remaining is not None:
+        response.close()
+    else:
+        # A chunked body's length isn't known up front, so only drain as much of it as a small remainder would be.
+        drained = 0
+        while drained <= limit:
+            chunk = response.raw.read(4096, decode_content=False)
+            if not chunk:
+                response.raw.drain_conn()
+                return
+            drained += len(chunk)
+        response.close()
+
+
+def read_until(response: Response, *patterns: str, keep_connection: bool = False) -> None:
+    # Stop reading a page once everything needed from it has been found, keeping what was read as its content.
+    if response._content_consumed:
+        return
+    content = b""
+    for chunk in response.iter_content(16384):
+        content += chunk
+        text = content.decode(response.encoding or "utf-8", errors="ignore")
+        if all(re.search(x, text) for x in patterns):
+            break
+    discard_body(response, keep_connection=keep_connection)
+    response._content = content
+    response._content_consumed = True
+
+
+@traced
 def get_base_required_cookies(
-    webdriver: WebDriver,
+    webdriver: "WebDriver",
+    wait: float = 10,
     logger: Logger = logging
 ) -> Dict[str, Optional[str]]:
-    logger.debug("-> Getting the base required cookies (involves waiting 10 seconds)…")
+    logger.debug(f"-> Getting the base required cookies (involves waiting {wait:g} seconds)…")
     webdriver.delete_all_cookies()
     webdriver.get("https://www.currys.co.uk/gbuk/s/authentication.html")
-    sleep(10)
+    sleep(wait)
     logger.debug("-> Finished waiting for the base required cookies.")
     cookies = webdriver.get_cookies()
     if cookies is None:
@@ -31,23 +91,36 @@ def get_base_required_cookies(
     return cookies
 
 
+@traced
+def preposition_webdriver(
+    webdriver: "WebDriver",
+    base_url: str = "payments.worldpay.com",
+    logger: Logger = logging
+) -> None:
+    logger.debug(f"-> Pre-positioning the webdriver on '{base_url}'…")
+    webdriver.get(f"https://{base_url}/favicon.ico")
+
+
+@traced
 def get_store_currys(
     session: Session,
     user_info: Config.UserInfo,
+    deadline: Optional[Deadline] = None,
     logger: Logger = logging
 ) -> Optional[str]:
     logger.debug("-> Getting the 'store-currys' cookie…")
     response = session.get(
         "https://www.currys.co.uk/gbuk/s/authentication.html",
         allow_redirects=False,
-        timeout=5
+        stream=True,
+        timeout=request_timeout(deadline, 5)
     )
     if not response.ok:
         response.raise_for_status()
-    matches = re.search(
-        r'data-login-token-name="(?P<name>\S+)"\s*data-login-token-value="(?P<value>\S+)"',
-        response.text
-    )
+    login_token_pattern = r'data-login-token-name="(?P<name>\S+)"\s*data-login-token-value="(?P<value>\S+)"'
+    # The login form is posted to the same host straight away, so its connection is kept if little of the page is left.
+    read_until(response, login_token_pattern, keep_connection=True)
+    matches = re.search(login_token_pattern, response.text)
     if matches is None:
         return None
     data = {
@@ -64,8 +137,10 @@ def get_store_currys(
         "https://www.currys.co.uk/gbuk/s/authentication.html",
         data=data,
         allow_redirects=False,
-        timeout=5
+        stream=True,
+        timeout=request_timeout(deadline, 5)
     )
+    discard_body(response)
     if response.status_code != codes.found:
         response.raise_for_status()
     if "store-currys" not in response.cookies:
@@ -75,16 +150,23 @@ def get_store_currys(
     return response.cookies["store-currys"]
 
 
+@traced
 def get_basket_id(
     session: Session,
+    deadline: Optional[Deadline] = None,
+    hedger: Optional[Hedger] = None,
     logger: Logger = logging
 ) -> str:
     logger.debug("-> Getting the basket ID…")
-    response = session.get(
-        "https://www.currys.co.uk/api/user/token",
-        data={},
-        allow_redirects=False,
-        timeout=5
+    response = send_request(
+        hedger,
+        "get_basket_id",
+        lambda: session.get(
+            "https://www.currys.co.uk/api/user/token",
+            data={},
+            allow_redirects=False,
+            timeout=request_timeout(deadline, 5)
+        )
     )
     if response.status_code != codes.ok:
         response.raise_for_status()
@@ -93,23 +175,57 @@ def get_basket_id(
     return basket_id
 
 
+@traced
 def get_basket(
     session: Session,
     basket_id: str,
+    deadline: Optional[Deadline] = None,
+    hedger: Optional[Hedger] = None,
     logger: Logger = logging
 ) -> Response:
     logger.debug(f"-> Getting basket '{basket_id}'…")
+    response = send_request(
+        hedger,
+        "get_basket",
+        lambda: session.get(
+            f"https://api.currys.co.uk/store/api/baskets/{basket_id}",
+            allow_redirects=False,
+            timeout=request_timeout(deadline, 5)
+        )
+    )
+    return response
+
+
+@traced
+def get_product_availability(
+    session: Session,
+    product_info: Config.ProductInfo,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+    deadline: Optional[Deadline] = None,
+    logger: Logger = logging
+) -> Response:
+    logger.debug(f"-> Probing the availability of product '{product_info.name}' ({product_info.pid})…")
+    headers = {}
+    if etag is not None:
+        headers["If-None-Match"] = etag
+    if last_modified is not None:
+        headers["If-Modified-Since"] = last_modified
     response = session.get(
-        f"https://api.currys.co.uk/store/api/baskets/{basket_id}",
+        f"https://api.currys.co.uk/store/api/products/{product_info.pid}",
+        headers=headers,
         allow_redirects=False,
-        timeout=5
+        stream=True,
+        timeout=request_timeout(deadline, 5)
     )
     return response
 
 
+@traced
 def add_product(
     session: Session,
     product_info: Config.ProductInfo,
+    deadline: Optional[Deadline] = None,
     logger: Logger = logging
 ) -> Response:
     logger.debug(
@@ -124,15 +240,19 @@ def add_product(
         "https://www.currys.co.uk/api/cart/addProduct",
         data=json.dumps(data),
         allow_redirects=False,
-        timeout=5
+        stream=True,
+        timeout=request_timeout(deadline, 5)
     )
+    discard_body(response)
     return response
 
 
+@traced
 def delete_product(
     session: Session,
     product_info: Config.ProductInfo,
     basket_id: str,
+    deadline: Optional[Deadline] = None,
     logger: Logger = logging
 ) -> Response:
     logger.debug(
@@ -142,15 +262,21 @@ def delete_product(
     response = session.delete(
         f"https://api.currys.co.uk/store/api/baskets/{basket_id}/products/{product_info.pid}",
         allow_redirects=False,
-        timeout=5
+        stream=True,
+        timeout=request_timeout(deadline, 5)
     )
+    discard_body(response)
     return response
 
 
+@traced
 def set_quantity(
     session: Session,
     product_info: Config.ProductInfo,
     basket_id: str,
+    deadline: Optional[Deadline] = None,
+    hedger: Optional[Hedger] = None,
+    read_body: bool = True,
     logger: Logger = logging
 ) -> Response:
     logger.debug(
@@ -158,19 +284,29 @@ def set_quantity(
         f" in basket '{basket_id}'…"
     )
     data = {"quantity": product_info.quantity}
-    response = session.put(
-        f"https://api.currys.co.uk/store/api/baskets/{basket_id}/products/{product_info.pid}/quantity",
-        data=data,
-        allow_redirects=False,
-        timeout=5
+    response = send_request(
+        hedger,
+        "set_quantity",
+        lambda: session.put(
+            f"https://api.currys.co.uk/store/api/baskets/{basket_id}/products/{product_info.pid}/quantity",
+            data=data,
+            allow_redirects=False,
+            stream=not read_body,
+            timeout=request_timeout(deadline, 5)
+        )
     )
+    if not read_body:
+        discard_body(response)
     return response
 
 
+@traced
 def set_home_delivery(
     session: Session,
     product_info: Config.ProductInfo,
     basket_id: str,
+    deadline: Optional[Deadline] = None,
+    hedger: Optional[Hedger] = None,
     logger: Logger = logging
 ) -> Response:
     logger.debug(
@@ -178,19 +314,27 @@ def set_home_delivery(
         f" in basket '{basket_id}' to home delivery…"
     )
     data = {"fulfilmentChannel": "home-delivery"}
-    response = session.put(
-        f"https://api.currys.co.uk/store/api/baskets/{basket_id}/products/{product_info.pid}/fulfilmentChannel",
-        data=data,
-        allow_redirects=False,
-        timeout=5
+    response = send_request(
+        hedger,
+        "set_home_delivery",
+        lambda: session.put(
+            f"https://api.currys.co.uk/store/api/baskets/{basket_id}/products/{product_info.pid}/fulfilmentChannel",
+            data=data,
+            allow_redirects=False,
+            stream=True,
+            timeout=request_timeout(deadline, 5)
+        )
     )
+    discard_body(response)
     return response
 
 
+@traced
 def get_consignments(
     session: Session,
     user_info: Config.UserInfo,
     basket_id: str,
+    deadline: Optional[Deadline] = None,
     logger: Logger = logging
 ) -> Response:
     logger.debug(f"-> Getting consignments for basket '{basket_id}'…")
@@ -203,16 +347,18 @@ def get_consignments(
         f"https://api.currys.co.uk/store/api/baskets/{basket_id}/deliveryLocation",
         data=data,
         allow_redirects=False,
-        timeout=5
+        timeout=request_timeout(deadline, 5)
     )
     return response
 
 
+@traced
 def set_delivery_slot(
     session: Session,
     consignment_type: str,
     delivery_slot: Dict[str, Any],
     basket_id: str,
+    deadline: Optional[Deadline] = None,
     logger: Logger = logging
 ) -> Response:
     logger.debug(
@@ -234,15 +380,17 @@ def set_delivery_slot(
         f"https://api.currys.co.uk/store/api/baskets/{basket_id}/consignments/{consignment_type}/deliverySlot",
         data=data,
         allow_redirects=False,
-        timeout=5
+        timeout=request_timeout(deadline, 5)
     )
     return response
 
 
+@traced
 def apply_offer_code(
     session: Session,
     product_info: Config.ProductInfo,
     basket_id: str,
+    deadline: Optional[Deadline] = None,
     logger: Logger = logging
 ) -> Response:
     logger.debug(
@@ -255,15 +403,17 @@ def apply_offer_code(
         f"https://api.currys.co.uk/store/api/baskets/{basket_id}/offerRedemptions",
         data=data,
         allow_redirects=False,
-        timeout=5
+        timeout=request_timeout(deadline, 5)
     )
     return response
 
 
+@traced
 def invalidate_payment_request(
     session: Session,
     payment_request_id: str,
     basket_id: str,
+    deadline: Optional[Deadline] = None,
     logger: Logger = logging
 ) -> Response:
     logger.debug(
@@ -278,28 +428,36 @@ def invalidate_payment_request(
         f"https://api.currys.co.uk/store/api/baskets/{basket_id}/payments/{payment_request_id}",
         data=json.dumps(data),
         allow_redirects=False,
-        timeout=20
+        stream=True,
+        timeout=request_timeout(deadline, 20)
     )
+    discard_body(response)
     return response
 
 
+@traced
 def create_order(
     session: Session,
     basket_id: str,
+    deadline: Optional[Deadline] = None,
     logger: Logger = logging
 ) -> Response:
     logger.debug(f"-> Creating order for basket '{basket_id}'…")
     response = session.post(
         f"https://api.currys.co.uk/store/api/baskets/{basket_id}/orders",
         allow_redirects=False,
-        timeout=20
+        stream=True,
+        timeout=request_timeout(deadline, 20)
     )
+    discard_body(response)
     return response
 
 
+@traced
 def create_payment_request(
     session: Session,
     basket_id: str,
+    deadline: Optional[Deadline] = None,
     logger: Logger = logging
 ) -> Response:
     logger.debug(f"-> Creating payment request for basket '{basket_id}'…")
@@ -308,45 +466,62 @@ def create_payment_request(
         f"https://api.currys.co.uk/store/api/baskets/{basket_id}/payments",
         data=json.dumps(data),
         allow_redirects=False,
-        timeout=20
+        timeout=request_timeout(deadline, 20)
     )
     return response
 
 
 # noinspection PyBroadException
+@traced
 def submit_payment(
     session: Session,
     payment_info: Config.PaymentInfo,
     payment_url: str,
-    webdriver: WebDriver,
+    webdriver: "WebDriver",
     notify: Optional[Callable] = None,
     dry_run=False,
+    deadline: Optional[Deadline] = None,
     logger: Logger = logging
 ) -> Optional[Response]:
     logger.debug(f"-> Submitting payment @ '{payment_url}'…")
+    timings = {}
+    started_at = perf_counter()
     response = session.get(
         payment_url,
         allow_redirects=False,
-        timeout=20
+        stream=True,
+        timeout=request_timeout(deadline, 20)
     )
     if not response.ok:
         return response
-    csrf_matches = re.search(r'name="_csrf" value="(?P<csrf>\S+)"', response.text)
-    api_matches = re.search(r'action="/(?P<api_path>\S+)/(?P<api_version>[\d\-]+)/\S+"', response.text)
+    # The rest of the payment is sent to the same host, so its connection is kept if little of the page is left.
+    csrf_pattern = r'name="_csrf" value="(?P<csrf>\S+)"'
+    api_pattern = r'action="/(?P<api_path>\S+)/(?P<api_version>[\d\-]+)/\S+"'
+    read_until(response, csrf_pattern, api_pattern, keep_connection=True)
+    csrf_matches = re.search(csrf_pattern, response.text)
+    api_matches = re.search(api_pattern, response.text)
     base_url = next(filter(lambda x: "worldpay.com" in x, payment_url.split("/")), "payments.worldpay.com")
     worldpay_api_url = f"https://{base_url}/{api_matches['api_path']}/{api_matches['api_version']}"
     cookies = {"JSESSIONID": response.cookies["JSESSIONID"]}
-    data = {"cardNumber": payment_info.card_number}
-    response = session.post(
-        f"{worldpay_api_url}/rest/cardtypes",
-        cookies=cookies,
-        data=data,
-        allow_redirects=False,
-        timeout=20
-    )
-    if not response.ok or not response.text:
-        return response
-    card_type = response.json()["cardType"]["type"]
+    timings["payment_page"] = perf_counter() - started_at
+    started_at = perf_counter()
+    card_key = sha256(payment_info.card_number.encode()).hexdigest()
+    card_type = _card_types.get(card_key)
+    if card_type is None:
+        data = {"cardNumber": payment_info.card_number}
+        response = session.post(
+            f"{worldpay_api_url}/rest/cardtypes",
+            cookies=cookies,
+            data=data,
+            allow_redirects=False,
+            timeout=request_timeout(deadline, 20)
+        )
+        if not response.ok or not response.text:
+            return response
+        card_type = response.json()["cardType"]["type"]
+        _card_types[card_key] = card_type
+    timings["card_type"] = perf_counter() - started_at
+    started_at = perf_counter()
     data = {
         "selectedPaymentMethodName": card_type,
         "cardNumber": payment_info.card_number,
@@ -365,11 +540,14 @@ def submit_payment(
         f"{worldpay_api_url}/payment/multicard/process",
         cookies=cookies,
         data=data,
-        timeout=20
+        timeout=request_timeout(deadline, 20)
     )
     if not response.ok or not response.text:
         return response
+    timings["process"] = perf_counter() - started_at
+    started_at = perf_counter()
     if dry_run:
+        log_payment_timings(timings, logger=logger)
         if notify is not None:
             try:
                 notify()
@@ -378,15 +556,36 @@ def submit_payment(
                 logger.error(format_exc())
         return None
     iframe_matches = re.search(r'src="\S+/payment/auth/(?P<iframe_keypath>\S+)/iframe"', response.text)
+    iframe_url = f"{worldpay_api_url}/payment/auth/{iframe_matches['iframe_keypath']}/iframe"
     logger.debug("-> Continuing in webdriver…")
-    webdriver.delete_all_cookies()
-    webdriver.get(f"{worldpay_api_url}/payment/auth/{iframe_matches['iframe_keypath']}/iframe")
-    for name, value in cookies.items():
-        webdriver.add_cookie({"name": name, "value": value})
-    webdriver.get(f"{worldpay_api_url}/payment/auth/{iframe_matches['iframe_keypath']}/iframe")
+    if urlsplit(webdriver.current_url).hostname == base_url:
+        for name, value in cookies.items():
+            webdriver.delete_cookie(name)
+            webdriver.add_cookie({"name": name, "value": value})
+        webdriver.get(iframe_url)
+    else:
+        logger.debug(f"-> The webdriver is not pre-positioned on '{base_url}'; navigating twice…")
+        webdriver.delete_all_cookies()
+        webdriver.get(iframe_url)
+        for name, value in cookies.items():
+            webdriver.add_cookie({"name": name, "value": value})
+        webdriver.get(iframe_url)
+    timings["handoff"] = perf_counter() - started_at
+    log_payment_timings(timings, logger=logger)
     if notify is not None:
         try:
             notify()
         except:
             logger.error("-> Error in notification callback.")
             logger.error(format_exc())
+
+
+def log_payment_timings(
+    timings: Dict[str, float],
+    logger: Logger = logging
+) -> None:
+    logger.info(
+        "-> Payment stage timings: "
+        + ", ".join(f"{name}={duration:.3f}s" for name, duration in timings.items())
+        + f" (total={sum(timings.values()):.3f}s)."
+    )
@@ -0,0 +1,181 @@
+import logging
+import re
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging import Logger
+from requests import Response
+from threading import Lock
+from time import monotonic
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from config import Config
+from tracing import request_size
+
+
+class EndpointUsage:
+    def __init__(self):
+        self.request_count = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.decoded_bytes = 0
+        self.skipped_count = 0
+        self.encodings: Dict[str, int] = {}
+
+
+class AttemptUsage:
+    def __init__(self, pid: str):
+        self.pid = pid
+        self.byte_count = 0
+        self.checkout_started = False
+        self.checkout_completed = False
+
+
+_current_attempt: ContextVar[Optional[AttemptUsage]] = ContextVar("current_attempt", default=None)
+
+
+def endpoint(response: Response) -> str:
+    url = urlsplit(response.request.url)
+    # Basket, product and payment IDs would otherwise give every basket its own endpoint.
+    path = re.sub(r"/(baskets|products|payments|consignments|integration)/[^/]+", r"/\1/{id}", url.path)
+    path = re.sub(r"/[^/{]*\d[^/]*", "/{id}", path)
+    return f"{response.request.method} {url.hostname}{path}"
+
+
+def response_header_size(response: Response) -> int:
+    headers_size = sum(len(name) + len(value) + 4 for name, value in response.headers.items())
+    return len(str(response.status_code)) + len(response.reason or "") + 12 + headers_size + 2
+
+
+def is_finished(response: Response) -> bool:
+    raw = response.raw
+    return response._content_consumed or raw is None or raw.closed or raw.length_remaining == 0
+
+
+def record_checkout_started() -> None:
+    usage = _current_attempt.get()
+    if usage is not None:
+        usage.checkout_started = True
+
+
+def record_checkout_completed() -> None:
+    usage = _current_attempt.get()
+    if usage is not None:
+        usage.checkout_completed = True
+
+
+def format_bytes(byte_count: float) -> str:
+    if byte_count < 1024:
+        return f"{byte_count:.0f} B"
+    elif byte_count < 1024 * 1024:
+        return f"{byte_count / 1024:.1f} KiB"
+    return f"{byte_count / 1024 / 1024:.1f} MiB"
+
+
+class BandwidthMeter:
+    def __init__(
+        self,
+        config: Config.Bandwidth,
+        logger: Logger = logging
+    ):
+        self.config = config
+        self.logger = logger
+
+        self.lock = Lock()
+        self.pending: List[Tuple[Response, str, Optional[AttemptUsage], float]] = []
+        self.endpoints: Dict[str, EndpointUsage] = {}
+        self.attempt_count = 0
+        self.attempt_bytes = 0
+        self.checkout_count = 0
+        self.checkout_bytes = 0
+        self.unfinished_checkout_bytes: Dict[str, int] = {}
+
+    # noinspection PyUnusedLocal
+    def record(self, response: Response, *args, **kwargs) -> None:
+        # The body hasn't been read yet when the hook runs, so the response is accounted for once it has been.
+        with self.lock:
+            self.pending.append((response, endpoint(response), _current_attempt.get(), monotonic()))
+        self.flush()
+
+    def flush(self, force: bool = False) -> None:
+        with self.lock:
+            # A body which is never read or closed is accounted for as far as it got after a minute.
+            expired_at = monotonic() - 60
+            pending = []
+            for response, name, usage, recorded_at in self.pending:
+                if force or recorded_at < expired_at or is_finished(response):
+                    self.account(response, name, usage)
+                else:
+                    pending.append((response, name, usage, recorded_at))
+            self.pending = pending
+
+    def account(self, response: Response, name: str, usage: Optional[AttemptUsage]) -> None:
+        request_bytes = request_size(response)
+        header_size = response_header_size(response)
+        content = response._content if isinstance(response._content, bytes) else None
+        body_size = response.raw.tell() if response.raw is not None else len(content or b"")
+        endpoint_usage = self.endpoints.setdefault(name, EndpointUsage())
+        endpoint_usage.request_count += 1
+        endpoint_usage.request_bytes += request_bytes
+        endpoint_usage.response_bytes += header_size + body_size
+        endpoint_usage.decoded_bytes += header_size + len(content or b"")
+        if content is None and body_size > 0:
+            endpoint_usage.skipped_count += 1
+        encoding = response.headers.get("Content-Encoding", "identity")
+        endpoint_usage.encodings[encoding] = endpoint_usage.encodings.get(encoding, 0) + 1
+        if usage is not None:
+            usage.byte_count += request_bytes + header_size + body_size
+
+    @contextmanager
+    def attempt(self, pid: str) -> Iterator[AttemptUsage]:
+        usage = AttemptUsage(pid)
+        token = _current_attempt.set(usage)
+        try:
+            yield usage
+        finally:
+            _current_attempt.reset(token)
+            self.flush()
+            self.record_attempt(usage)
+
+    def record_attempt(self, usage: AttemptUsage) -> None:
+        with self.lock:
+            self.attempt_count += 1
+            self.attempt_bytes += usage.byte_count
+            # A checkout is charged for every attempt it took, including those which failed part of the way through.
+            if usage.checkout_started:
+                self.unfinished_checkout_bytes[usage.pid] = (
+                    self.unfinished_checkout_bytes.get(usage.pid, 0) + usage.byte_count
+                )
+            if usage.checkout_completed:
+                self.checkout_count += 1
+                self.checkout_bytes += self.unfinished_checkout_bytes.pop(usage.pid, 0)
+            attempt_count = self.attempt_count
+        if attempt_count % self.config.report_interval == 0:
+            self.log_report()
+        elif usage.checkout_completed:
+            self.log_report(endpoint_count=0)
+
+    def log_report(self, endpoint_count: Optional[int] = None) -> None:
+        self.flush()
+        with self.lock:
+            endpoints = sorted(self.endpoints.items(), key=lambda x: x[1].response_bytes, reverse=True)
+            attempt_count, attempt_bytes = self.attempt_count, self.attempt_bytes
+            checkout_count, checkout_bytes = self.checkout_count, self.checkout_bytes
+        self.logger.info(
+            f"-> Bandwidth over {attempt_count} attempts: {format_bytes(attempt_bytes / max(attempt_count, 1))}"
+            " per attempt"
+            + (
+                f", {format_bytes(checkout_bytes / checkout_count)} per successful checkout"
+                f" ({checkout_count} checkouts)."
+                if checkout_count > 0 else "; no successful checkouts yet."
+            )
+        )
+        for name, usage in endpoints[:self.config.report_endpoints if endpoint_count is None else endpoint_count]:
+            encodings = ", ".join(f"{x} ×{count}" for x, count in sorted(usage.encodings.items()))
+            self.logger.info(
+                f"->   {name}: {usage.request_count} requests,"
+                f" {format_bytes(usage.request_bytes)} sent,"
+                f" {format_bytes(usage.response_bytes)} received"
+                f" ({format_bytes(usage.decoded_bytes)} decoded, {usage.skipped_count} bodies skipped; {encodings})."
+            )
@@ -0,0 +1,101 @@
+import logging
+
+from logging import Logger
+from requests import Response
+from threading import Lock
+from time import monotonic
+from typing import Dict, Iterable, List, Optional
+
+from config import Config
+
+
+class BasketCoordinator:
+    def __init__(
+        self,
+        product_infos: Iterable[Config.ProductInfo],
+        in_stock_ttl: float = 5,
+        logger: Logger = logging
+    ):
+        self.product_infos: Dict[str, Config.ProductInfo] = {x.pid: x for x in product_infos}
+        self.in_stock_ttl = in_stock_ttl
+        self.logger = logger
+
+        self.checkout_lock = Lock()
+        self.checkout_owner: Optional[str] = None
+        self.in_stock: Dict[str, float] = {}
+        self.in_stock_lock = Lock()
+        self.pending_pids = set()
+
+        self.request_count = 0
+        self.checkout_count = 0
+        self.checked_out_product_count = 0
+        self.counts_lock = Lock()
+
+    # noinspection PyUnusedLocal
+    def count_request(self, response: Response, *args, **kwargs) -> None:
+        if response.request.method == "HEAD":
+            return
+        with self.counts_lock:
+            self.request_count += 1
+
+    def report_in_stock(self, pid: str) -> None:
+        with self.in_stock_lock:
+            self.in_stock[pid] = monotonic()
+
+    def report_out_of_stock(self, pid: str) -> None:
+        with self.in_stock_lock:
+            self.in_stock.pop(pid, None)
+
+    def is_wanted(self, pid: str) -> bool:
+        with self.in_stock_lock:
+            reported_at = self.in_stock.get(pid)
+            pending = pid in self.pending_pids
+        return (
+            pid in self.product_infos
+            and not pending
+            and reported_at is not None
+            and monotonic() - reported_at <= self.in_stock_ttl
+        )
+
+    def wanted_product_infos(self) -> List[Config.ProductInfo]:
+        return [x for pid, x in self.product_infos.items() if self.is_wanted(pid)]
+
+    def begin_completion(self, pids: Iterable[str]) -> None:
+        with self.in_stock_lock:
+            self.pending_pids.update(pids)
+
+    def end_completion(self, pids: Iterable[str]) -> None:
+        with self.in_stock_lock:
+            self.pending_pids.difference_update(pids)
+
+    def is_pending(self, pid: str) -> bool:
+        with self.in_stock_lock:
+            return pid in self.pending_pids
+
+    def acquire_checkout(self, product_info: Config.ProductInfo) -> bool:
+        if not self.checkout_lock.acquire(blocking=False):
+            return False
+        self.checkout_owner = product_info.pid
+        return True
+
+    def owned_by_another(self, pid: str) -> bool:
+        owner = self.checkout_owner
+        return owner is not None and owner != pid
+
+    def release_checkout(self) -> None:
+        self.checkout_owner = None
+        self.checkout_lock.release()
+
+    def record_checkout(self, pids: Iterable[str]) -> None:
+        pids = list(pids)
+        with self.counts_lock:
+            self.checkout_count += 1
+            self.checked_out_product_count += len(pids)
+            request_count, checkout_count = self.request_count, self.checkout_count
+        self.logger.info(
+            f"-> Checked out {len(pids)} {'product' if len(pids) == 1 else 'products'}"
+            f" ({', '.join(pids)}) in one order;"
+            f" {request_count / checkout_count:.1f} requests per successful checkout"
+            f" over {checkout_count} checkout{'' if checkout_count == 1 else 's'}"
+            f" with {len(self.product_infos)} configured products."
+        )
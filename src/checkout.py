@@ -0,0 +1,49 @@
+import logging
+
+from enum import IntEnum
+from logging import Logger
+from typing import Dict, List
+
+
+class CheckoutState(IntEnum):
+    ADD_PRODUCT = 0
+    SET_QUANTITY = 1
+    CLEAN_BASKET = 2
+    SET_DELIVERY_METHOD = 3
+    GET_CONSIGNMENTS = 4
+    SET_DELIVERY_SLOTS = 5
+    APPLY_OFFER_CODES = 6
+    INVALIDATE_PAYMENT_REQUESTS = 7
+    CREATE_ORDER = 8
+    CREATE_PAYMENT_REQUEST = 9
+    SUBMIT_PAYMENT = 10
+    COMPLETE = 11
+
+    @property
+    def label(self) -> str:
+        return self.name.lower()
+
+
+class CheckoutTimer:
+    def __init__(self):
+        self.durations: Dict[CheckoutState, List[float]] = {}
+        self.stall_counts: Dict[CheckoutState, int] = {}
+
+    def record(self, state: CheckoutState, duration: float) -> None:
+        self.durations.setdefault(state, []).append(duration)
+        if len(self.durations[state]) > 1000:
+            del self.durations[state][:500]
+
+    def record_stall(self, state: CheckoutState) -> None:
+        self.stall_counts[state] = self.stall_counts.get(state, 0) + 1
+
+    def log_summary(self, logger: Logger = logging) -> None:
+        logger.info(
+            "-> Time per checkout state: "
+            + ", ".join(
+                f"{state.label} {sum(durations) / len(durations):.3f}s avg"
+                f" ×{len(durations)} ({self.stall_counts.get(state, 0)} stalled)"
+                for state, durations in sorted(self.durations.items())
+            )
+            + "."
+        )
@@ -0,0 +1,97 @@
+import logging
+
+from argparse import ArgumentParser
+from os import path
+from tempfile import mkdtemp
+from time import sleep
+from typing import List, Tuple
+
+import coloredlogs
+
+from basket import BasketCoordinator
+from config import Config
+from ledger import PurchaseLedger
+from scalper import Scalper
+from soak import SoakScalper
+from standin import StandInAdapter, StandInBackend
+
+
+def run(product_count: int, args, logger: logging.Logger) -> Tuple[BasketCoordinator, StandInBackend]:
+    logger.info(f"-> Measuring {product_count} products for {args.duration:g}s…")
+    backend = StandInBackend(stock_period=args.stock_period, in_stock_seconds=args.in_stock_seconds)
+    Scalper.session.mount("https://", StandInAdapter(backend))
+    Scalper.session.cookies.clear()
+    basket_logger = logging.getLogger(f"Checkouts Basket {product_count}")
+    basket_logger.setLevel(logging.WARNING)
+    product_infos = [Config.ProductInfo(f"Checkout Product {i}", str(40000000 + i), 1) for i in range(product_count)]
+    basket_coordinator = BasketCoordinator(product_infos, logger=basket_logger)
+    Scalper.session.hooks["response"] = [basket_coordinator.count_request]
+
+    scalper_config = Config.Scalper(
+        chromedriver_location="",
+        delivery_sort_method="price_low_high",
+        dry_run=True,
+        ssl_verify=True,
+        completion_timeout=0.1,
+        ledger_path=path.join(mkdtemp(), "purchases.jsonl")
+    )
+    ledger = PurchaseLedger(scalper_config.ledger_path)
+    scalpers: List[Scalper] = []
+    for product_info in product_infos:
+        scalper = SoakScalper(
+            config=scalper_config,
+            ifttt_config=Config.IFTTT(key="", webhook_event_names=[]),
+            payment_info=Config.PaymentInfo("4444333322221111", "Checkout Test", "01", "30", "123"),
+            product_info=product_info,
+            user_info=Config.UserInfo("checkouts@example.com", "", "AB1 2CD", 0, 0),
+            max_product_name_length=max(len(x.name) for x in product_infos),
+            basket_coordinator=basket_coordinator,
+            ledger=ledger
+        )
+        scalper.poll_interval = args.poll_interval
+        scalper.logger.setLevel(logging.CRITICAL + 1)
+        scalper.daemon = True
+        scalpers.append(scalper)
+    for scalper in scalpers:
+        scalper.start()
+    sleep(args.duration)
+    for scalper in scalpers:
+        scalper.retired = True
+        scalper.woken.set()
+    for scalper in scalpers:
+        scalper.join(timeout=30)
+    return basket_coordinator, backend
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Measure the requests each successful checkout takes against the stand-in.")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to measure each product count for.")
+    parser.add_argument("--products", type=int, action="append", help="Number of products (may be repeated).")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="Seconds between attempts.")
+    parser.add_argument("--stock-period", type=float, default=5, help="Seconds between the stand-in's restocks.")
+    parser.add_argument("--in-stock-seconds", type=float, default=1, help="Seconds each restock lasts.")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("Checkouts")
+    coloredlogs.install(fmt="[%(name)s] : [%(levelname)-8s] : %(message)s", level=logging.INFO, logger=logger)
+
+    results = [(x, run(x, args, logger)) for x in args.products or [1, 5, 20]]
+    for product_count, (basket_coordinator, backend) in results:
+        request_count = basket_coordinator.request_count
+        checkout_count = basket_coordinator.checkout_count
+        product_count_checked_out = basket_coordinator.checked_out_product_count
+        logger.info(
+            f"-> {product_count} products: {request_count} requests,"
+            f" {checkout_count} checkouts of {product_count_checked_out} products"
+            f" ({backend.order_count} orders of {backend.ordered_product_count} products);"
+            + (
+                f" {request_count / checkout_count:.1f} requests per successful checkout,"
+                f" {request_count / product_count_checked_out:.1f} per product checked out."
+                if checkout_count > 0 else " no successful checkouts."
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,115 @@
+import logging
+
+from logging import Logger
+from requests import Session
+from requests.exceptions import RequestException
+from threading import Event, Thread
+from time import monotonic
+from traceback import format_exc
+from typing import Callable, Optional, TYPE_CHECKING
+from urllib.parse import urlsplit
+
+import API
+
+from watchdog import WebDriverHang
+
+if TYPE_CHECKING:
+    from selenium.webdriver.chrome.webdriver import WebDriver
+
+
+class CompletionMonitor(Thread):
+    SUCCESS = "success"
+    FAILURE = "failure"
+    TIMEOUT = "timeout"
+
+    success_url_markers = ("currys.co.uk/gbuk/confirmation", "order-confirmation", "/checkout/confirmation")
+    failure_url_markers = ("failure", "cancel", "declined", "error")
+    success_payment_statuses = ("authorised", "completed", "success")
+    failure_payment_statuses = ("failed", "refused", "cancelled")
+
+    def __init__(
+        self,
+        webdriver: "WebDriver",
+        session: Session,
+        basket_id: str,
+        on_outcome: Callable[[str], None],
+        timeout: float = 60,
+        poll_interval: float = 1,
+        confirm_interval: float = 30,
+        logger: Logger = logging
+    ):
+        super().__init__(daemon=True)
+        self.webdriver = webdriver
+        self.session = session
+        self.basket_id = basket_id
+        self.on_outcome = on_outcome
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.confirm_interval = confirm_interval
+        self.logger = logger
+
+        self.outcome: Optional[str] = None
+        self.stopped = Event()
+
+    def check_browser(self) -> Optional[str]:
+        from selenium.common.exceptions import WebDriverException
+
+        try:
+            current_url = urlsplit(self.webdriver.current_url.lower())
+        except (WebDriverException, WebDriverHang):
+            return None
+        # Payment pages carry success, failure and cancel URLs in their query strings, so only match the page itself.
+        target = f"{current_url.hostname or ''}{current_url.path}"
+        if any(x in target for x in self.success_url_markers):
+            return CompletionMonitor.SUCCESS
+        if any(x in target for x in self.failure_url_markers):
+            return CompletionMonitor.FAILURE
+        return None
+
+    def check_basket(self) -> Optional[str]:
+        try:
+            response = API.get_basket(
+                session=self.session,
+                basket_id=self.basket_id,
+                logger=self.logger
+            )
+            if not response.ok:
+                return None
+            payment_requests = response.json()["payload"]["paymentRequests"]
+        except (RequestException, ValueError, KeyError):
+            return None
+        statuses = {x["status"] for x in payment_requests}
+        if statuses & set(self.success_payment_statuses):
+            return CompletionMonitor.SUCCESS
+        if payment_requests and statuses <= set(self.failure_payment_statuses):
+            return CompletionMonitor.FAILURE
+        return None
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    # noinspection PyBroadException
+    def report(self, outcome: str) -> None:
+        self.outcome = outcome
+        try:
+            self.on_outcome(outcome)
+        except:
+            self.logger.error("-> Error in completion callback.")
+            self.logger.error(format_exc())
+
+    def run(self) -> None:
+        self.logger.debug(f"-> Monitoring payment completion for up to {self.timeout:.0f} seconds…")
+        deadline = monotonic() + self.timeout
+        poll_interval = self.poll_interval
+        outcome = None
+        while not self.stopped.is_set():
+            outcome = self.check_browser() or self.check_basket()
+            if outcome is not None:
+                break
+            # A payment which times out may still be approved, so keep watching, less often, until it's confirmed.
+            if self.outcome is None and monotonic() >= deadline:
+                self.report(CompletionMonitor.TIMEOUT)
+                poll_interval = self.confirm_interval
+            self.stopped.wait(poll_interval)
+        if outcome is not None:
+            self.report(outcome)
@@ -1,7 +1,8 @@
 import json
 
+from datetime import datetime
 from functools import cached_property
-from typing import Optional
+from typing import Dict, Optional
 
 
 class Config:
@@ -11,12 +12,54 @@ class Config:
             chromedriver_location: str,
             delivery_sort_method: str,
             dry_run: bool,
-            ssl_verify: bool
+            ssl_verify: bool,
+            probe_force_interval: int = 60,
+            completion_timeout: float = 60,
+            ledger_path: str = "purchases.jsonl",
+            attempt_deadline: float = 60,
+            hedge_percentile: float = 95
         ):
             self.chromedriver_location = chromedriver_location
             self.delivery_sort_method = delivery_sort_method
             self.dry_run = dry_run
             self.ssl_verify = ssl_verify
+            self.probe_force_interval = probe_force_interval
+            self.completion_timeout = completion_timeout
+            self.ledger_path = ledger_path
+            self.attempt_deadline = attempt_deadline
+            self.hedge_percentile = hedge_percentile
+
+    class Bandwidth:
+        def __init__(
+            self,
+            enabled: bool = True,
+            report_interval: int = 1000,
+            report_endpoints: int = 10
+        ):
+            self.enabled = enabled
+            self.report_interval = report_interval
+            self.report_endpoints = report_endpoints
+
+    class Drop:
+        def __init__(
+            self,
+            time: str,
+            window: float = 300,
+            lead_time: float = 120,
+            early: float = 2,
+            interval: float = 0.1,
+            clock_url: str = "https://api.currys.co.uk/"
+        ):
+            self.time = time
+            self.window = window
+            self.lead_time = lead_time
+            self.early = early
+            self.interval = interval
+            self.clock_url = clock_url
+
+        @cached_property
+        def release_time(self) -> float:
+            return datetime.fromisoformat(self.time).timestamp()
 
     class IFTTT:
         def __init__(
@@ -27,6 +70,34 @@ class Config:
             self.key = key
             self.webhook_event_names = webhook_event_names
 
+    class Prewarm:
+        def __init__(
+            self,
+            enabled: bool = True,
+            hosts: [str] = ("www.currys.co.uk", "api.currys.co.uk", "payments.worldpay.com"),
+            interval: float = 25,
+            connections_per_host: int = 1,
+            dns_ttl: float = 300
+        ):
+            self.enabled = enabled
+            self.hosts = list(hosts)
+            self.interval = interval
+            self.connections_per_host = connections_per_host
+            self.dns_ttl = dns_ttl
+
+    class Journal:
+        def __init__(
+            self,
+            enabled: bool = True,
+            path: str = "journal/probes.log",
+            max_bytes: int = 16777216,
+            backup_count: int = 5
+        ):
+            self.enabled = enabled
+            self.path = path
+            self.max_bytes = max_bytes
+            self.backup_count = backup_count
+
     class PaymentInfo:
         def __init__(
             self,
@@ -42,18 +113,71 @@ class Config:
             self.expiry_year = expiry_year
             self.security_code = security_code
 
+    class Profiler:
+        def __init__(
+            self,
+            output_dir: str = "profiles",
+            sample_interval: float = 0.01,
+            window: float = 30,
+            attempts: int = 10,
+            port: int = 0
+        ):
+            self.output_dir = output_dir
+            self.sample_interval = sample_interval
+            self.window = window
+            self.attempts = attempts
+            self.port = port
+
     class ProductInfo:
         def __init__(
             self,
             name: str,
             pid: str,
             quantity: int,
-            offer_code: str = ""
+            offer_code: str = "",
+            drop: Optional["Config.Drop"] = None
         ):
             self.name = name
             self.pid = pid
             self.quantity = quantity
             self.offer_code = offer_code
+            self.drop = drop
+
+    class Scheduler:
+        def __init__(
+            self,
+            enabled: bool = False,
+            request_budget: float = 3600,
+            min_interval: float = 0.5,
+            lead_time: float = 300,
+            refresh_interval: float = 3600,
+            history_days: float = 28,
+            smoothing: float = 0.5
+        ):
+            self.enabled = enabled
+            self.request_budget = request_budget
+            self.min_interval = min_interval
+            self.lead_time = lead_time
+            self.refresh_interval = refresh_interval
+            self.history_days = history_days
+            self.smoothing = smoothing
+
+    class Tracing:
+        def __init__(
+            self,
+            enabled: bool = False,
+            path: str = "traces/traces.jsonl",
+            max_bytes: int = 67108864,
+            backup_count: int = 3,
+            checkouts_only: bool = True,
+            service_name: str = "currys-scalper"
+        ):
+            self.enabled = enabled
+            self.path = path
+            self.max_bytes = max_bytes
+            self.backup_count = backup_count
+            self.checkouts_only = checkouts_only
+            self.service_name = service_name
 
     class UserInfo:
         def __init__(
@@ -70,6 +194,19 @@ class Config:
             self.latitude = latitude
             self.longitude = longitude
 
+    class Watchdog:
+        def __init__(
+            self,
+            default_timeout: float = 15,
+            page_load_timeout: float = 30,
+            script_timeout: float = 30,
+            timeouts: Optional[Dict[str, float]] = None
+        ):
+            self.default_timeout = default_timeout
+            self.page_load_timeout = page_load_timeout
+            self.script_timeout = script_timeout
+            self.timeouts = {"get": page_load_timeout + 15, "launch": 60, "quit": 10} | (timeouts or {})
+
     def __init__(self, json_dict: Optional[str] = None):
         if json_dict is not None:
             self.config_dict = json.loads(json_dict)
@@ -101,6 +238,11 @@ class Config:
             delivery_sort_method=scalper_config["delivery_sort_method"],
             dry_run=scalper_config["dry_run"],
             ssl_verify=scalper_config["ssl_verify"],
+            probe_force_interval=scalper_config.get("probe_force_interval", 60),
+            completion_timeout=scalper_config.get("completion_timeout", 60),
+            ledger_path=scalper_config.get("ledger_path", "purchases.jsonl"),
+            attempt_deadline=scalper_config.get("attempt_deadline", 60),
+            hedge_percentile=scalper_config.get("hedge_percentile", 95)
         )
 
     @cached_property
@@ -111,6 +253,14 @@ class Config:
             webhook_event_names=ifttt_config["webhook_event_names"]
         )
 
+    @cached_property
+    def prewarm_config(self) -> Prewarm:
+        return Config.Prewarm(**self.config_dict.get("prewarm", {}))
+
+    @cached_property
+    def journal_config(self) -> Journal:
+        return Config.Journal(**self.config_dict.get("journal", {}))
+
     @cached_property
     def payment_info(self) -> PaymentInfo:
         payment_info = self.config_dict["payment_info"]
@@ -122,13 +272,39 @@ class Config:
             security_code=payment_info["security_code"]
         )
 
+    @cached_property
+    def profiler_config(self) -> Profiler:
+        return Config.Profiler(**self.config_dict.get("profiler", {}))
+
     @cached_property
     def product_infos(self) -> [ProductInfo]:
         return [
-            Config.ProductInfo(x["name"], x["pid"], x["quantity"], x["offer_code"])
+            Config.ProductInfo(
+                x["name"],
+                x["pid"],
+                x["quantity"],
+                x["offer_code"],
+                Config.Drop(**x["drop"]) if "drop" in x else None
+            )
             for x in self.config_dict["product_infos"]
         ]
 
+    @cached_property
+    def scheduler_config(self) -> Scheduler:
+        return Config.Scheduler(**self.config_dict.get("scheduler", {}))
+
+    @cached_property
+    def watchdog_config(self) -> Watchdog:
+        return Config.Watchdog(**self.config_dict.get("watchdog", {}))
+
+    @cached_property
+    def tracing_config(self) -> Tracing:
+        return Config.Tracing(**self.config_dict.get("tracing", {}))
+
+    @cached_property
+    def bandwidth_config(self) -> Bandwidth:
+        return Config.Bandwidth(**self.config_dict.get("bandwidth", {}))
+
     @cached_property
     def user_info(self) -> UserInfo:
         user_info = self.config_dict["user_info"]
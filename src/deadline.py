@@ -0,0 +1,126 @@
+import logging
+
+from collections import deque
+from concurrent.futures import Future, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from logging import Logger
+from requests import Response
+from requests.exceptions import Timeout
+from threading import Lock
+from time import monotonic, perf_counter
+from typing import Callable, Deque, Dict, Iterable, Optional
+
+import tracing
+
+
+def percentile(values: Iterable[float], p: float) -> Optional[float]:
+    values = sorted(values)
+    if len(values) == 0:
+        return None
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+class Deadline:
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = monotonic() + budget
+
+    def remaining(self) -> float:
+        return self.expires_at - monotonic()
+
+    def timeout(self, default: float) -> float:
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise Timeout(f"The attempt's {self.budget:g} second deadline has passed.")
+        return min(default, remaining)
+
+
+def request_timeout(deadline: Optional[Deadline], default: float) -> float:
+    return default if deadline is None else deadline.timeout(default)
+
+
+class Hedger:
+    def __init__(
+        self,
+        hedge_percentile: float = 95,
+        min_samples: int = 20,
+        max_samples: int = 200,
+        logger: Logger = logging
+    ):
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.logger = logger
+
+        self.executor = ThreadPoolExecutor(thread_name_prefix="Hedger")
+        self.latencies: Dict[str, Deque[float]] = {}
+        self.checkout_durations: Deque[float] = deque(maxlen=max_samples)
+        self.lock = Lock()
+        self.request_count = 0
+        self.hedge_count = 0
+        self.hedge_win_count = 0
+
+    def record(self, operation: str, latency: float) -> None:
+        with self.lock:
+            self.latencies.setdefault(operation, deque(maxlen=self.max_samples)).append(latency)
+
+    def threshold(self, operation: str) -> Optional[float]:
+        if self.hedge_percentile <= 0:
+            return None
+        with self.lock:
+            latencies = list(self.latencies.get(operation, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        return percentile(latencies, self.hedge_percentile)
+
+    def timed(self, operation: str, send: Callable[[], Response]) -> Response:
+        started_at = perf_counter()
+        response = send()
+        self.record(operation, perf_counter() - started_at)
+        return response
+
+    def request(self, operation: str, send: Callable[[], Response]) -> Response:
+        with self.lock:
+            self.request_count += 1
+        threshold = self.threshold(operation)
+        if threshold is None:
+            return self.timed(operation, send)
+        primary = self.executor.submit(copy_context().run, self.timed, operation, send)
+        done, _ = wait([primary], timeout=threshold)
+        if done:
+            return primary.result()
+        self.logger.debug(f"-> Hedging '{operation}' after {threshold:.3f}s…")
+        with self.lock:
+            self.hedge_count += 1
+        tracing.set_attribute("hedge.fired", True)
+        hedge = self.executor.submit(copy_context().run, self.timed, operation, send)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    tracing.set_attribute("hedge.won", future is hedge)
+                    if future is hedge:
+                        with self.lock:
+                            self.hedge_win_count += 1
+                    for loser in pending:
+                        loser.add_done_callback(Hedger.close_response)
+                    return future.result()
+        return primary.result()
+
+    def record_checkout(self, duration: float) -> None:
+        with self.lock:
+            self.checkout_durations.append(duration)
+            checkout_durations = list(self.checkout_durations)
+            request_count, hedge_count, hedge_win_count = self.request_count, self.hedge_count, self.hedge_win_count
+        self.logger.info(
+            f"-> Time to checkout over the last {len(checkout_durations)} checkouts:"
+            f" p50 {percentile(checkout_durations, 50):.3f}s, p99 {percentile(checkout_durations, 99):.3f}s"
+            f" (hedging at p{self.hedge_percentile:g}; {hedge_count}/{request_count} idempotent requests hedged,"
+            f" {hedge_win_count} hedges won)."
+        )
+
+    @staticmethod
+    def close_response(future: Future) -> None:
+        if future.exception() is None:
+            future.result().close()
@@ -0,0 +1,100 @@
+import logging
+
+from email.utils import parsedate_to_datetime
+from logging import Logger
+from requests import Session
+from requests.exceptions import RequestException
+from time import localtime, sleep, strftime, time
+from typing import List, Optional, Tuple
+
+from config import Config
+
+
+def measure_clock_offset(
+    session: Session,
+    url: str,
+    samples: int = 12,
+    spacing: float = 0.15,
+    logger: Logger = logging
+) -> Optional[Tuple[float, float]]:
+    # A 'Date' header only has one second of resolution, so each sample bounds the offset to within one second plus
+    # the round trip; intersecting the bounds of samples taken either side of a tick narrows it much further.
+    bounds: List[Tuple[float, float]] = []
+    for _ in range(samples):
+        sent_at = time()
+        try:
+            response = session.head(url, allow_redirects=False, timeout=5)
+        except RequestException as e:
+            logger.warning(f"-> Failed to sample the server's clock: {e}.")
+            continue
+        received_at = time()
+        response.close()
+        if "Date" not in response.headers:
+            logger.warning(f"-> The response from {url} has no 'Date' header.")
+            return None
+        server_time = parsedate_to_datetime(response.headers["Date"]).timestamp()
+        bounds.append((server_time - received_at, server_time + 1 - sent_at))
+        sleep(spacing)
+    if len(bounds) == 0:
+        return None
+    lower, upper = max(x for x, _ in bounds), min(x for _, x in bounds)
+    if lower > upper:
+        midpoints = sorted((x + y) / 2 for x, y in bounds)
+        return midpoints[len(midpoints) // 2], max(y - x for x, y in bounds) / 2
+    return (lower + upper) / 2, (upper - lower) / 2
+
+
+class DropWindow:
+    def __init__(
+        self,
+        drop: Config.Drop,
+        session: Session,
+        logger: Logger = logging
+    ):
+        self.drop = drop
+        self.session = session
+        self.logger = logger
+
+        self.offset = 0.0
+        self.uncertainty: Optional[float] = None
+        self.prepared = False
+        self.release_to_basket: Optional[float] = None
+
+    def server_time(self) -> float:
+        return time() + self.offset
+
+    def seconds_until_release(self) -> float:
+        return self.drop.release_time - self.server_time()
+
+    def due_for_preparation(self) -> bool:
+        return not self.prepared and -self.drop.window < self.seconds_until_release() <= self.drop.lead_time
+
+    def is_open(self) -> bool:
+        return -self.drop.window <= self.seconds_until_release() <= self.drop.early
+
+    def synchronise_clock(self) -> None:
+        measurement = measure_clock_offset(self.session, self.drop.clock_url, logger=self.logger)
+        if measurement is None:
+            self.logger.warning("-> Failed to measure the clock offset; assuming the local clock is correct.")
+            return
+        self.offset, self.uncertainty = measurement
+        self.logger.info(
+            f"-> The server's clock is {self.offset:+.3f}s (±{self.uncertainty:.3f}s) from the local clock;"
+            f" the drop is at {strftime('%H:%M:%S', localtime(self.drop.release_time - self.offset))} local time."
+        )
+
+    def poll_interval(self, default: float) -> Optional[float]:
+        if self.is_open():
+            return self.drop.interval
+        # Wake up exactly when the window opens rather than up to a whole poll interval after it.
+        seconds_until_open = self.seconds_until_release() - self.drop.early
+        if 0 < seconds_until_open < default:
+            return seconds_until_open
+        return None
+
+    def record_added(self) -> None:
+        seconds_until_release = self.seconds_until_release()
+        if self.release_to_basket is not None or not -self.drop.window <= seconds_until_release <= 0:
+            return
+        self.release_to_basket = -seconds_until_release
+        self.logger.info(f"-> Added the product to the basket {self.release_to_basket:.3f}s after the drop.")
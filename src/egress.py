@@ -0,0 +1,154 @@
+import logging
+
+from argparse import ArgumentParser
+from os import path
+from requests import Response
+from requests.utils import default_headers
+from tempfile import mkdtemp
+from time import sleep
+from typing import List, Tuple
+
+import coloredlogs
+
+from urllib3.util.request import ACCEPT_ENCODING
+
+import API
+
+from bandwidth import BandwidthMeter, EndpointUsage, format_bytes
+from basket import BasketCoordinator
+from config import Config
+from ledger import PurchaseLedger
+from scalper import Scalper
+from soak import SoakScalper
+from standin import StandInAdapter, StandInBackend
+
+
+# noinspection PyUnusedLocal
+def read_body(response: Response, *args, **kwargs) -> None:
+    # Before, every response that wasn't a stock probe was read in full as soon as it arrived.
+    if not kwargs.get("stream", False) or "/store/api/products/" not in response.request.url:
+        response.content
+
+
+def run(name: str, minimise: bool, args, logger: logging.Logger) -> BandwidthMeter:
+    logger.info(f"-> Measuring '{name}' for {args.duration:g}s…")
+    # Both runs look up the card type, rather than the second using the first's memo.
+    API._card_types.clear()
+    backend = StandInBackend(page_size=args.page_size)
+    Scalper.session.mount("https://", StandInAdapter(backend))
+    Scalper.session.cookies.clear()
+    Scalper.session.headers["Accept-Encoding"] = ACCEPT_ENCODING if minimise else default_headers()["Accept-Encoding"]
+    meter_logger = logging.getLogger(f"Egress {name}")
+    meter_logger.setLevel(logging.WARNING)
+    meter = BandwidthMeter(Config.Bandwidth(report_interval=10 ** 9), logger=meter_logger)
+    Scalper.session.hooks["response"] = ([] if minimise else [read_body]) + [meter.record]
+
+    product_infos = [Config.ProductInfo(f"Egress Product {i}", str(30000000 + i), 1) for i in range(args.products)]
+    scalper_config = Config.Scalper(
+        chromedriver_location="",
+        delivery_sort_method="price_low_high",
+        dry_run=True,
+        ssl_verify=True,
+        completion_timeout=0.1,
+        ledger_path=path.join(mkdtemp(), "purchases.jsonl")
+    )
+    basket_logger = logging.getLogger("Egress Basket")
+    basket_logger.setLevel(logging.WARNING)
+    basket_coordinator = BasketCoordinator(product_infos, logger=basket_logger)
+    ledger = PurchaseLedger(scalper_config.ledger_path)
+    scalpers: List[Scalper] = []
+    for product_info in product_infos:
+        scalper = SoakScalper(
+            config=scalper_config,
+            ifttt_config=Config.IFTTT(key="", webhook_event_names=[]),
+            payment_info=Config.PaymentInfo("4444333322221111", "Egress Test", "01", "30", "123"),
+            product_info=product_info,
+            user_info=Config.UserInfo("egress@example.com", "", "AB1 2CD", 0, 0),
+            max_product_name_length=max(len(x.name) for x in product_infos),
+            basket_coordinator=basket_coordinator,
+            ledger=ledger,
+            bandwidth_meter=meter
+        )
+        scalper.poll_interval = args.poll_interval
+        scalper.logger.setLevel(logging.CRITICAL + 1)
+        scalper.daemon = True
+        scalpers.append(scalper)
+    for scalper in scalpers:
+        scalper.start()
+    sleep(args.duration)
+    for scalper in scalpers:
+        scalper.retired = True
+        scalper.woken.set()
+    for scalper in scalpers:
+        scalper.join(timeout=30)
+    meter.flush(force=True)
+    return meter
+
+
+def per_attempt(meter: BandwidthMeter) -> Tuple[float, float]:
+    return (
+        meter.attempt_bytes / max(meter.attempt_count, 1),
+        meter.checkout_bytes / meter.checkout_count if meter.checkout_count > 0 else 0
+    )
+
+
+def per_request(usage: EndpointUsage) -> Tuple[float, float]:
+    return (
+        (usage.request_bytes + usage.response_bytes) / usage.request_count,
+        usage.decoded_bytes / usage.request_count
+    )
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Measure the bytes each attempt and checkout uses against the stand-in.")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to measure each configuration for.")
+    parser.add_argument("--products", type=int, default=2, help="Number of stand-in products to scalp.")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="Seconds between attempts.")
+    parser.add_argument("--page-size", type=int, default=150000, help="Size of the stand-in's HTML pages.")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("Egress")
+    coloredlogs.install(fmt="[%(name)s] : [%(levelname)-8s] : %(message)s", level=logging.INFO, logger=logger)
+
+    meters = [(x, run(x, x == "after", args, logger)) for x in ("before", "after")]
+    for name, meter in meters:
+        attempt_bytes, checkout_bytes = per_attempt(meter)
+        logger.info(
+            f"-> {name.capitalize()}: {meter.attempt_count} attempts, {meter.checkout_count} checkouts;"
+            f" {format_bytes(attempt_bytes)} per attempt, {format_bytes(checkout_bytes)} per successful checkout."
+        )
+        for endpoint, usage in sorted(meter.endpoints.items(), key=lambda x: x[1].response_bytes, reverse=True):
+            logger.info(
+                f"->   {endpoint}: {format_bytes(usage.response_bytes / usage.request_count)} received"
+                f" ({format_bytes(usage.decoded_bytes / usage.request_count)} decoded) per request,"
+                f" {usage.skipped_count}/{usage.request_count} bodies skipped."
+            )
+    # The runs make different numbers of probes and checkouts, so each endpoint is compared per request,
+    # and the totals are priced over the same requests: those the 'before' run made.
+    (_, before), (_, after) = meters
+    before_bytes, after_bytes = [0.0, 0.0], [0.0, 0.0]
+    for endpoint, usage in sorted(before.endpoints.items(), key=lambda x: x[1].response_bytes, reverse=True):
+        if endpoint not in after.endpoints:
+            logger.warning(f"-> {endpoint} was only requested before; leaving it out of the comparison.")
+            continue
+        before_request_bytes, after_request_bytes = per_request(usage), per_request(after.endpoints[endpoint])
+        for i in range(2):
+            before_bytes[i] += before_request_bytes[i] * usage.request_count
+            after_bytes[i] += after_request_bytes[i] * usage.request_count
+        logger.info(
+            f"-> {endpoint}: {format_bytes(before_request_bytes[0])} → {format_bytes(after_request_bytes[0])}"
+            f" on the wire, {format_bytes(before_request_bytes[1])} → {format_bytes(after_request_bytes[1])}"
+            " decoded per request."
+        )
+    for label, before_total, after_total in zip(("on the wire", "decoded"), before_bytes, after_bytes):
+        if before_total > 0:
+            logger.info(
+                f"-> Bytes {label} for the same {sum(x.request_count for x in before.endpoints.values())} requests:"
+                f" {format_bytes(before_total)} → {format_bytes(after_total)}"
+                f" ({(after_total - before_total) / before_total * 100:+.1f}%)."
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,318 @@
+import json
+import logging
+import random
+import re
+
+from argparse import ArgumentParser
+from io import BytesIO
+from os import path
+from requests import PreparedRequest, Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.exceptions import ConnectionError, ReadTimeout
+from tempfile import mkdtemp
+from threading import Lock
+from time import monotonic, sleep
+from typing import Any, Dict, List, Optional
+
+import coloredlogs
+
+from urllib3.exceptions import ProtocolError
+
+from basket import BasketCoordinator
+from config import Config
+from ledger import PurchaseLedger
+from scalper import Scalper
+from soak import SoakScalper
+from standin import StandInAdapter, StandInBackend, build_response
+
+
+class Fault:
+    def __init__(
+        self,
+        type: str,
+        match: str = "",
+        probability: float = 1,
+        burst: int = 1,
+        distribution: str = "fixed",
+        value: float = 0,
+        low: float = 0,
+        high: float = 0,
+        median: float = 0,
+        sigma: float = 0,
+        mean: float = 0,
+        status: int = 503,
+        retry_after: Optional[float] = None,
+        fraction: float = 0.5,
+        chunk_size: int = 16,
+        chunk_delay: float = 0.1
+    ):
+        self.type = type
+        self.match = re.compile(match)
+        self.probability = probability
+        self.burst = burst
+        self.distribution = distribution
+        self.value = value
+        self.low = low
+        self.high = high
+        self.median = median
+        self.sigma = sigma
+        self.mean = mean
+        self.status = status
+        self.retry_after = retry_after
+        self.fraction = fraction
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+
+        self.burst_remaining = 0
+
+    def latency(self, rng: random.Random) -> float:
+        if self.distribution == "uniform":
+            return rng.uniform(self.low, self.high)
+        elif self.distribution == "lognormal":
+            return rng.lognormvariate(0, self.sigma) * self.median
+        elif self.distribution == "exponential":
+            return rng.expovariate(1 / self.mean) if self.mean > 0 else 0
+        return self.value
+
+
+class Phase:
+    def __init__(
+        self,
+        name: str,
+        duration: float,
+        faults: List[Dict[str, Any]] = ()
+    ):
+        self.name = name
+        self.duration = duration
+        self.faults = [Fault(**x) for x in faults]
+
+
+class Scenario:
+    def __init__(
+        self,
+        name: str,
+        phases: List[Dict[str, Any]],
+        seed: Optional[int] = None
+    ):
+        self.name = name
+        self.phases = [Phase(**x) for x in phases]
+        self.seed = seed
+
+    @staticmethod
+    def from_file_path(path: str):
+        with open(path, "r") as file:
+            return Scenario(**json.load(file))
+
+
+class DripStream:
+    def __init__(self, body: bytes, chunk_size: int, chunk_delay: float):
+        self.body = BytesIO(body)
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        sleep(self.chunk_delay)
+        return self.body.read(min(amt or self.chunk_size, self.chunk_size))
+
+    # urllib3 checks whether its file object is closed before every read, so this has to look like one.
+    @property
+    def closed(self) -> bool:
+        return self.body.closed
+
+    def close(self) -> None:
+        self.body.close()
+
+
+def read_timeout(timeout) -> Optional[float]:
+    if isinstance(timeout, tuple):
+        return timeout[1]
+    return timeout
+
+
+class FaultInjectingAdapter(HTTPAdapter):
+    def __init__(self, adapter: BaseAdapter, seed: Optional[int] = None):
+        super().__init__()
+        self.adapter = adapter
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self.faults: List[Fault] = []
+        self.injected_counts: Dict[str, int] = {}
+
+    def set_faults(self, faults: List[Fault]) -> None:
+        with self.lock:
+            self.faults = faults
+
+    def triggered_faults(self, request: PreparedRequest) -> Dict[str, Fault]:
+        # At most one fault of each type is injected into a request, so a fault that can't apply doesn't spend its burst.
+        triggered: Dict[str, Fault] = {}
+        with self.lock:
+            for fault in self.faults:
+                if fault.type in triggered or not fault.match.search(request.url):
+                    continue
+                if fault.burst_remaining > 0:
+                    fault.burst_remaining -= 1
+                elif self.random.random() < fault.probability:
+                    fault.burst_remaining = fault.burst - 1
+                else:
+                    continue
+                triggered[fault.type] = fault
+                self.injected_counts[fault.type] = self.injected_counts.get(fault.type, 0) + 1
+        return triggered
+
+    def send(self, request: PreparedRequest, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        faults = self.triggered_faults(request)
+        if "latency" in faults:
+            latency = faults["latency"].latency(self.random)
+            timeout_after = read_timeout(timeout)
+            if timeout_after is not None and latency > timeout_after:
+                sleep(timeout_after)
+                raise ReadTimeout(f"Injected latency of {latency:.3f}s exceeded the read timeout.", request=request)
+            sleep(latency)
+        if "reset" in faults:
+            raise ConnectionError(
+                ProtocolError("Connection aborted.", ConnectionResetError(104, "Connection reset by peer")),
+                request=request
+            )
+        if "status" in faults:
+            fault = faults["status"]
+            headers = {"Content-Type": "text/html"}
+            if fault.retry_after is not None:
+                headers["Retry-After"] = f"{fault.retry_after:g}"
+            return build_response(self, request, fault.status, headers, f"Injected {fault.status}".encode())
+
+        response = self.adapter.send(request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+        if not {"truncate", "non_json", "drip"} & faults.keys():
+            return response
+        return self.rewrite(request, response, faults)
+
+    def rewrite(self, request: PreparedRequest, response: Response, faults: Dict[str, Fault]) -> Response:
+        body = response.content
+        headers = {
+            name: value for name, value in response.headers.items()
+            if name.lower() not in ("content-encoding", "content-length", "transfer-encoding")
+        }
+        if "non_json" in faults:
+            body = b"<html><body>Please wait while we check your browser...</body></html>"
+            headers["Content-Type"] = "text/html"
+        if "truncate" in faults:
+            headers["Content-Length"] = str(len(body))
+            body = body[:int(len(body) * faults["truncate"].fraction)]
+        body_stream = None
+        if "drip" in faults:
+            body_stream = DripStream(body, faults["drip"].chunk_size, faults["drip"].chunk_delay)
+        return build_response(self, request, response.status_code, headers, body, body_stream=body_stream)
+
+    def close(self) -> None:
+        self.adapter.close()
+
+
+class PhaseReport:
+    def __init__(self, phase: Phase):
+        self.phase = phase
+        self.attempt_count = 0
+        self.order_count = 0
+        self.rebootstrap_count = 0
+        self.clear_cache_count = 0
+        self.injected_counts: Dict[str, int] = {}
+        self.ended_at = 0.0
+        self.ended_order_count = 0
+        self.recovery_time: Optional[float] = None
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Run the scalp loop against the stand-in through a fault-injection scenario.")
+    parser.add_argument("scenario", help="Path of the scenario file.")
+    parser.add_argument("--products", type=int, default=2, help="Number of stand-in products to scalp.")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="Seconds between attempts.")
+    parser.add_argument("--attempt-deadline", type=float, default=10, help="Seconds each checkout attempt may take.")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("Faults")
+    coloredlogs.install(fmt="[%(name)s] : [%(levelname)-8s] : %(message)s", level=logging.INFO, logger=logger)
+
+    scenario = Scenario.from_file_path(args.scenario)
+    backend = StandInBackend(stock_period=float("inf"), in_stock_seconds=float("inf"))
+    adapter = FaultInjectingAdapter(StandInAdapter(backend), seed=scenario.seed)
+    Scalper.session.mount("https://", adapter)
+    product_infos = [Config.ProductInfo(f"Fault Product {i}", str(20000000 + i), 1) for i in range(args.products)]
+    scalper_config = Config.Scalper(
+        chromedriver_location="",
+        delivery_sort_method="price_low_high",
+        dry_run=True,
+        ssl_verify=True,
+        completion_timeout=0.1,
+        ledger_path=path.join(mkdtemp(), "purchases.jsonl"),
+        attempt_deadline=args.attempt_deadline
+    )
+    basket_logger = logging.getLogger("Faults Basket")
+    basket_logger.setLevel(logging.WARNING)
+    basket_coordinator = BasketCoordinator(product_infos, logger=basket_logger)
+    ledger = PurchaseLedger(scalper_config.ledger_path)
+    scalpers = []
+    for product_info in product_infos:
+        scalper = SoakScalper(
+            config=scalper_config,
+            ifttt_config=Config.IFTTT(key="", webhook_event_names=[]),
+            payment_info=Config.PaymentInfo("4444333322221111", "Fault Test", "01", "30", "123"),
+            product_info=product_info,
+            user_info=Config.UserInfo("faults@example.com", "", "AB1 2CD", 0, 0),
+            max_product_name_length=max(len(x.name) for x in product_infos),
+            basket_coordinator=basket_coordinator,
+            ledger=ledger
+        )
+        scalper.poll_interval = args.poll_interval
+        scalper.logger.setLevel(logging.CRITICAL + 1)
+        scalper.daemon = True
+        scalpers.append(scalper)
+    for scalper in scalpers:
+        scalper.start()
+
+    reports = [PhaseReport(x) for x in scenario.phases]
+    # Every faulty phase recovers independently, even while a later phase is injecting faults of its own.
+    recovering: List[PhaseReport] = []
+    for report in reports:
+        logger.info(f"-> Phase '{report.phase.name}' for {report.phase.duration:g}s…")
+        attempt_count = sum(x.attempt_count for x in scalpers)
+        rebootstrap_count = sum(x.rebootstrap_count for x in scalpers)
+        clear_cache_count = sum(x.clear_cache_count for x in scalpers)
+        order_count = backend.order_count
+        injected_counts = dict(adapter.injected_counts)
+        adapter.set_faults(report.phase.faults)
+        ends_at = monotonic() + report.phase.duration
+        while monotonic() < ends_at:
+            for recovered in [x for x in recovering if backend.order_count > x.ended_order_count]:
+                recovered.recovery_time = monotonic() - recovered.ended_at
+                recovering.remove(recovered)
+            sleep(0.05)
+        report.attempt_count = sum(x.attempt_count for x in scalpers) - attempt_count
+        report.rebootstrap_count = sum(x.rebootstrap_count for x in scalpers) - rebootstrap_count
+        report.clear_cache_count = sum(x.clear_cache_count for x in scalpers) - clear_cache_count
+        report.order_count = backend.order_count - order_count
+        report.injected_counts = {
+            name: count - injected_counts.get(name, 0) for name, count in adapter.injected_counts.items()
+        }
+        if len(report.phase.faults) > 0:
+            report.ended_at, report.ended_order_count = monotonic(), backend.order_count
+            recovering.append(report)
+    adapter.set_faults([])
+
+    logger.info(f"-> Scenario '{scenario.name}':")
+    for report in reports:
+        injected = ", ".join(f"{count} {name}" for name, count in sorted(report.injected_counts.items()) if count)
+        recovery = ""
+        if len(report.phase.faults) > 0:
+            recovery = (
+                f"; recovered in {report.recovery_time:.1f}s" if report.recovery_time is not None
+                else "; did not recover before the end of the scenario"
+            )
+        logger.info(
+            f"->   {report.phase.name}: {report.attempt_count / (report.phase.duration / 60):.0f} attempts/min,"
+            f" {report.order_count} orders, {report.clear_cache_count} cache clears,"
+            f" {report.rebootstrap_count} Chrome rebootstraps"
+            f" (injected: {injected or 'nothing'}){recovery}."
+        )
+    return 0 if len(recovering) == 0 else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,107 @@
+import logging
+
+from argparse import ArgumentParser
+from os import path
+from tempfile import mkdtemp
+from time import sleep
+from typing import List
+
+import coloredlogs
+
+from basket import BasketCoordinator
+from config import Config
+from deadline import Hedger, percentile
+from faults import FaultInjectingAdapter, Scenario
+from ledger import PurchaseLedger
+from scalper import Scalper
+from soak import SoakScalper
+from standin import StandInAdapter, StandInBackend
+
+
+def run(hedge_percentile: float, scenario: Scenario, args, logger: logging.Logger) -> Hedger:
+    phase = next(x for x in scenario.phases if len(x.faults) > 0)
+    logger.info(f"-> Measuring hedging at p{hedge_percentile:g} through phase '{phase.name}' for {args.duration:g}s…")
+    backend = StandInBackend(stock_period=float("inf"), in_stock_seconds=float("inf"))
+    # Both runs draw the same sequence of faults.
+    adapter = FaultInjectingAdapter(StandInAdapter(backend), seed=scenario.seed)
+    adapter.set_faults(phase.faults)
+    Scalper.session.mount("https://", adapter)
+    Scalper.session.cookies.clear()
+    hedger_logger = logging.getLogger(f"Hedging p{hedge_percentile:g}")
+    hedger_logger.setLevel(logging.WARNING)
+    hedger = Hedger(hedge_percentile=hedge_percentile, max_samples=10 ** 6, logger=hedger_logger)
+
+    product_infos = [Config.ProductInfo(f"Hedging Product {i}", str(50000000 + i), 1) for i in range(args.products)]
+    scalper_config = Config.Scalper(
+        chromedriver_location="",
+        delivery_sort_method="price_low_high",
+        dry_run=True,
+        ssl_verify=True,
+        completion_timeout=0.1,
+        ledger_path=path.join(mkdtemp(), "purchases.jsonl"),
+        hedge_percentile=hedge_percentile
+    )
+    basket_logger = logging.getLogger(f"Hedging Basket p{hedge_percentile:g}")
+    basket_logger.setLevel(logging.WARNING)
+    basket_coordinator = BasketCoordinator(product_infos, logger=basket_logger)
+    ledger = PurchaseLedger(scalper_config.ledger_path)
+    scalpers: List[Scalper] = []
+    for product_info in product_infos:
+        scalper = SoakScalper(
+            config=scalper_config,
+            ifttt_config=Config.IFTTT(key="", webhook_event_names=[]),
+            payment_info=Config.PaymentInfo("4444333322221111", "Hedging Test", "01", "30", "123"),
+            product_info=product_info,
+            user_info=Config.UserInfo("hedging@example.com", "", "AB1 2CD", 0, 0),
+            max_product_name_length=max(len(x.name) for x in product_infos),
+            basket_coordinator=basket_coordinator,
+            ledger=ledger,
+            hedger=hedger
+        )
+        scalper.poll_interval = args.poll_interval
+        scalper.logger.setLevel(logging.CRITICAL + 1)
+        scalper.daemon = True
+        scalpers.append(scalper)
+    for scalper in scalpers:
+        scalper.start()
+    sleep(args.duration)
+    for scalper in scalpers:
+        scalper.retired = True
+        scalper.woken.set()
+    for scalper in scalpers:
+        scalper.join(timeout=30)
+    return hedger
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Compare time to checkout against the stand-in with and without hedging.")
+    parser.add_argument("scenario", help="Path of the scenario file; the faults of its first faulty phase are used.")
+    parser.add_argument("--duration", type=float, default=120, help="Seconds to measure each configuration for.")
+    parser.add_argument("--products", type=int, default=2, help="Number of stand-in products to scalp.")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="Seconds between attempts.")
+    parser.add_argument("--hedge-percentile", type=float, default=95, help="Percentile to hedge at when hedging.")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("Hedging")
+    coloredlogs.install(fmt="[%(name)s] : [%(levelname)-8s] : %(message)s", level=logging.INFO, logger=logger)
+
+    scenario = Scenario.from_file_path(args.scenario)
+    hedgers = [(x, run(x, scenario, args, logger)) for x in (0, args.hedge_percentile)]
+    for hedge_percentile, hedger in hedgers:
+        name = "Without hedging" if hedge_percentile <= 0 else f"Hedging at p{hedge_percentile:g}"
+        checkout_durations = list(hedger.checkout_durations)
+        if len(checkout_durations) == 0:
+            logger.warning(f"-> {name}: no successful checkouts.")
+            continue
+        logger.info(
+            f"-> {name}: {len(checkout_durations)} checkouts; time to checkout"
+            + ",".join(f" p{x} {percentile(checkout_durations, x):.3f}s" for x in (50, 90, 99))
+            + f", max {max(checkout_durations):.3f}s"
+            f" ({hedger.hedge_count}/{hedger.request_count} idempotent requests hedged,"
+            f" {hedger.hedge_win_count} hedges won)."
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,132 @@
+from os import path, replace, makedirs
+from threading import Lock
+from time import localtime, time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from config import Config
+
+
+IN_STOCK = "in"
+OUT_OF_STOCK = "out"
+OBSERVED = "observed"
+HOURS_PER_WEEK = 168
+
+
+def journal_file_paths(file_path: str, backup_count: int) -> List[str]:
+    file_paths = [f"{file_path}.{i}" for i in range(backup_count, 0, -1)] + [file_path]
+    return [x for x in file_paths if path.exists(x)]
+
+
+def read_journal(file_path: str, backup_count: int = 5) -> Iterator[Tuple[float, str, str]]:
+    for journal_file_path in journal_file_paths(file_path, backup_count):
+        with open(journal_file_path, "r") as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) == 3:
+                    yield float(fields[0]), fields[1], fields[2]
+
+
+def restock_times(entries: Iterator[Tuple[float, str, str]]) -> Tuple[Dict[str, List[float]], Dict[str, Set[int]]]:
+    restocks: Dict[str, List[float]] = {}
+    observed_hours: Dict[str, Set[int]] = {}
+    stock_states: Dict[str, Optional[bool]] = {}
+    for timestamp, pid, event in entries:
+        if event == IN_STOCK:
+            if stock_states.get(pid) is not True:
+                restocks.setdefault(pid, []).append(timestamp)
+            stock_states[pid] = True
+        elif event == OUT_OF_STOCK:
+            stock_states[pid] = False
+        else:
+            observed_hours.setdefault(pid, set()).add(int(timestamp // 3600))
+    return restocks, observed_hours
+
+
+def hour_of_week(timestamp: float) -> int:
+    local_time = localtime(timestamp)
+    return local_time.tm_wday * 24 + local_time.tm_hour
+
+
+def restock_distribution(
+    restocks: Dict[str, List[float]],
+    observed_hours: Dict[str, Set[int]],
+    since: float = 0
+) -> Tuple[List[int], List[int]]:
+    restock_counts = [0] * HOURS_PER_WEEK
+    for timestamps in restocks.values():
+        for timestamp in timestamps:
+            if timestamp >= since:
+                restock_counts[hour_of_week(timestamp)] += 1
+    observed_counts = [0] * HOURS_PER_WEEK
+    for hour in set().union(*observed_hours.values()):
+        if hour * 3600 < since:
+            continue
+        observed_counts[hour_of_week(hour * 3600)] += 1
+    return restock_counts, observed_counts
+
+
+class RotatingFile:
+    def __init__(self, file_path: str, max_bytes: int, backup_count: int):
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self.lock = Lock()
+        self.file = None
+        self.size = 0
+
+    def open(self) -> None:
+        directory = path.dirname(self.file_path)
+        if directory:
+            makedirs(directory, exist_ok=True)
+        self.file = open(self.file_path, "a")
+        self.size = self.file.tell()
+
+    def rotate(self) -> None:
+        self.file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if path.exists(f"{self.file_path}.{i}"):
+                replace(f"{self.file_path}.{i}", f"{self.file_path}.{i + 1}")
+        if self.backup_count > 0:
+            replace(self.file_path, f"{self.file_path}.1")
+        self.file = open(self.file_path, "w")
+        self.size = 0
+
+    def write(self, line: str) -> None:
+        with self.lock:
+            if self.file is None:
+                self.open()
+            elif self.size + len(line) > self.max_bytes:
+                self.rotate()
+            self.file.write(line)
+            self.file.flush()
+            self.size += len(line)
+
+
+class RestockJournal:
+    def __init__(self, config: Config.Journal):
+        self.config = config
+
+        self.file = RotatingFile(config.path, config.max_bytes, config.backup_count)
+        self.stock_states: Dict[str, bool] = {}
+        self.observed_hours: Dict[str, int] = {}
+
+    def write(self, pid: str, event: str) -> None:
+        self.file.write(f"{time():.3f} {pid} {event}\n")
+
+    def record_probe(self, pid: str) -> None:
+        # Only the hours a product was watched in are needed, so one probe an hour is journalled, not every probe.
+        hour = int(time() // 3600)
+        if self.observed_hours.get(pid) == hour:
+            return
+        self.observed_hours[pid] = hour
+        self.write(pid, OBSERVED)
+
+    def record_stock(self, pid: str, in_stock: bool) -> None:
+        if self.stock_states.get(pid) == in_stock:
+            return
+        self.stock_states[pid] = in_stock
+        self.write(pid, IN_STOCK if in_stock else OUT_OF_STOCK)
+
+    def read(self) -> Iterator[Tuple[float, str, str]]:
+        return read_journal(self.config.path, self.config.backup_count)
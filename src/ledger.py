@@ -0,0 +1,48 @@
+import json
+
+from datetime import datetime, timezone
+from os import path
+from threading import Lock
+from typing import Dict
+
+from config import Config
+
+
+class PurchaseLedger:
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.lock = Lock()
+        self.purchased_quantities: Dict[str, int] = {}
+        if path.exists(file_path):
+            with open(file_path, "r") as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.purchased_quantities[entry["pid"]] = (
+                            self.purchased_quantities.get(entry["pid"], 0) + entry["quantity"]
+                        )
+
+    def record(self, product_info: Config.ProductInfo, quantity: int) -> None:
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "pid": product_info.pid,
+            "name": product_info.name,
+            "quantity": quantity
+        }
+        with self.lock:
+            with open(self.file_path, "a") as file:
+                file.write(json.dumps(entry) + "\n")
+            self.purchased_quantities[product_info.pid] = self.purchased_quantities.get(product_info.pid, 0) + quantity
+
+    def remaining_quantity(self, product_info: Config.ProductInfo) -> int:
+        with self.lock:
+            return max(product_info.quantity - self.purchased_quantities.get(product_info.pid, 0), 0)
+
+    def remaining_product_info(self, product_info: Config.ProductInfo) -> Config.ProductInfo:
+        return Config.ProductInfo(
+            name=product_info.name,
+            pid=product_info.pid,
+            quantity=self.remaining_quantity(product_info),
+            offer_code=product_info.offer_code,
+            drop=product_info.drop
+        )
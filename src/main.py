@@ -1,24 +1,110 @@
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
 from os import environ
 
+import coloredlogs
+
+from urllib3.util.request import ACCEPT_ENCODING
+
+import tracing
+
+from bandwidth import BandwidthMeter
+from basket import BasketCoordinator
 from scalper import Scalper
 from config import Config
+from deadline import Hedger
+from journal import RestockJournal
+from ledger import PurchaseLedger
+from prewarm import Prewarmer
+from profiler import Profiler
+from scheduler import PollScheduler
+from startup import StartupTimer
+from tracing import Tracer
+from watchdog import WebDriverWatchdog
+
+
+def get_logger(name: str) -> logging.Logger:
+    logger = logging.getLogger(name)
+    coloredlogs.install(
+        fmt="[%(name)s] : [%(levelname)-8s] : %(message)s",
+        level=logging.INFO,
+        logger=logger
+    )
+    return logger
 
 
 if __name__ == "__main__":
-    config = Config(environ["CONFIG"]) if "CONFIG" in environ else Config.from_file_path("config.json")
-    max_product_name_length = max([len(x.name) for x in config.product_infos])
-    scalpers = []
-    for product_info in config.product_infos:
-        scalper = Scalper(
-            config=config.scalper_config,
-            ifttt_config=config.ifttt_config,
-            payment_info=config.payment_info,
-            product_info=product_info,
-            user_info=config.user_info,
-            max_product_name_length=max_product_name_length
-        )
-        scalper.daemon = True
-        scalper.start()
-        scalpers.append(scalper)
+    startup_timer = StartupTimer(logger=get_logger("Startup"))
+    with startup_timer.phase("config"):
+        config = Config(environ["CONFIG"]) if "CONFIG" in environ else Config.from_file_path("config.json")
+        max_product_name_length = max([len(x.name) for x in config.product_infos])
+        startup_timer.expected_count = len(config.product_infos)
+    with startup_timer.phase("services"):
+        prewarmer = None
+        if config.prewarm_config.enabled:
+            prewarmer = Prewarmer(Scalper.session, config.prewarm_config, logger=get_logger("Prewarmer"))
+        basket_coordinator = BasketCoordinator(config.product_infos, logger=get_logger("Basket"))
+        Scalper.session.hooks["response"].append(basket_coordinator.count_request)
+        # Offer every encoding urllib3 can decode (including Brotli, if it's installed), so the server can pick the best.
+        Scalper.session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        bandwidth_meter = None
+        if config.bandwidth_config.enabled:
+            bandwidth_meter = BandwidthMeter(config.bandwidth_config, logger=get_logger("Bandwidth"))
+            Scalper.session.hooks["response"].append(bandwidth_meter.record)
+        ledger = PurchaseLedger(config.scalper_config.ledger_path)
+        watchdog = WebDriverWatchdog(config.watchdog_config, logger=get_logger("Watchdog"))
+        hedger = Hedger(hedge_percentile=config.scalper_config.hedge_percentile, logger=get_logger("Hedger"))
+        scalpers = []
+        profiler = Profiler(config.profiler_config, threads=lambda: scalpers, logger=get_logger("Profiler"))
+        profiler.install_signal_handlers()
+        if config.profiler_config.port:
+            profiler.serve()
+        journal = RestockJournal(config.journal_config) if config.journal_config.enabled else None
+        scheduler = None
+        if config.scheduler_config.enabled and journal is not None:
+            scheduler = PollScheduler(
+                config.scheduler_config,
+                journal=journal,
+                threads=lambda: scalpers,
+                prewarmer=prewarmer,
+                logger=get_logger("Scheduler")
+            )
+        tracer = None
+        if config.tracing_config.enabled:
+            tracer = Tracer(config.tracing_config, logger=get_logger("Tracer"))
+            Scalper.session.hooks["response"].append(tracing.record_request)
+    with startup_timer.phase("construction"), ThreadPoolExecutor(len(config.product_infos)) as executor:
+        scalpers.extend(executor.map(
+            lambda product_info: Scalper(
+                config=config.scalper_config,
+                ifttt_config=config.ifttt_config,
+                payment_info=config.payment_info,
+                product_info=product_info,
+                user_info=config.user_info,
+                max_product_name_length=max_product_name_length,
+                prewarmer=prewarmer,
+                basket_coordinator=basket_coordinator,
+                ledger=ledger,
+                profiler=profiler,
+                startup_timer=startup_timer,
+                hedger=hedger,
+                journal=journal,
+                scheduler=scheduler,
+                watchdog=watchdog,
+                tracer=tracer,
+                bandwidth_meter=bandwidth_meter
+            ),
+            config.product_infos
+        ))
+    with startup_timer.phase("start"):
+        for scalper in scalpers:
+            scalper.daemon = True
+            scalper.start()
+            scalper.launch_browser_in_background()
+        if prewarmer is not None:
+            prewarmer.start()
+        if scheduler is not None:
+            scheduler.start()
     for scalper in scalpers:
         scalper.join()
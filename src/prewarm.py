@@ -0,0 +1,144 @@
+import logging
+import socket
+
+from logging import Logger
+from requests import Session
+from requests.exceptions import RequestException
+from threading import Event, Lock, Thread
+from time import monotonic
+from traceback import format_exc
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+from urllib3.util.connection import is_connection_dropped
+
+from config import Config
+
+
+_getaddrinfo = socket.getaddrinfo
+_dns_cache: Dict[Tuple, Tuple[float, list]] = {}
+_dns_cache_lock = Lock()
+_dns_cache_hosts = set()
+_dns_cache_ttl = 300.0
+
+
+def _cached_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    if host not in _dns_cache_hosts:
+        return _getaddrinfo(host, port, family, type, proto, flags)
+    key = (host, port, family, type, proto, flags)
+    with _dns_cache_lock:
+        entry = _dns_cache.get(key)
+    if entry is not None and entry[0] > monotonic():
+        return entry[1]
+    addresses = _getaddrinfo(host, port, family, type, proto, flags)
+    with _dns_cache_lock:
+        _dns_cache[key] = (monotonic() + _dns_cache_ttl, addresses)
+    return addresses
+
+
+def install_dns_cache(hosts: List[str], ttl: float) -> None:
+    global _dns_cache_ttl
+    _dns_cache_hosts.update(hosts)
+    _dns_cache_ttl = ttl
+    socket.getaddrinfo = _cached_getaddrinfo
+
+
+def resolve(host: str, port: int = 443) -> list:
+    with _dns_cache_lock:
+        for key in [x for x in _dns_cache if x[0] == host]:
+            del _dns_cache[key]
+    return socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+
+
+class Prewarmer(Thread):
+    def __init__(
+        self,
+        session: Session,
+        config: Config.Prewarm,
+        logger: Logger = logging
+    ):
+        super().__init__(daemon=True)
+        self.session = session
+        self.config = config
+        self.logger = logger
+
+        self.cycle_count = 0
+        self.hot_path_counts: Dict[str, List[int]] = {host: [0, 0] for host in config.hosts}
+        self.hot_path_lock = Lock()
+        self.stopped = Event()
+
+        install_dns_cache(config.hosts, config.dns_ttl)
+
+    def is_warm(self, url: str) -> bool:
+        pool = self.session.get_adapter(url).poolmanager.connection_from_url(url)
+        return any(
+            connection is not None
+            and connection.sock is not None
+            and not is_connection_dropped(connection)
+            for connection in list(pool.pool.queue)
+        )
+
+    def record_hot_path(self, url: str) -> bool:
+        host = urlsplit(url).hostname
+        warm = self.is_warm(url)
+        with self.hot_path_lock:
+            counts = self.hot_path_counts.setdefault(host, [0, 0])
+            counts[0] += warm
+            counts[1] += 1
+        if not warm:
+            self.logger.debug(f"-> No warm connection to '{host}' on the hot path.")
+        return warm
+
+    def warm_host(self, host: str) -> None:
+        try:
+            resolve(host)
+        except OSError as e:
+            self.logger.warning(f"-> Failed to resolve '{host}': {e}.")
+            return
+        url = f"https://{host}/"
+        threads = [
+            Thread(target=self.touch, args=(url,), daemon=True)
+            for _ in range(self.config.connections_per_host)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def touch(self, url: str) -> None:
+        try:
+            response = self.session.head(url, allow_redirects=False, timeout=5)
+            response.close()
+        except RequestException as e:
+            self.logger.warning(f"-> Failed to warm a connection to '{url}': {e}.")
+
+    def warm(self) -> None:
+        self.cycle_count += 1
+        for host in self.config.hosts:
+            self.warm_host(host)
+        self.logger.debug(f"-> Warmed connections to {len(self.config.hosts)} hosts.")
+        if self.cycle_count % 10 == 0:
+            self.log_stats()
+
+    def log_stats(self) -> None:
+        with self.hot_path_lock:
+            counts = {host: list(x) for host, x in self.hot_path_counts.items()}
+        for host, (warm, total) in counts.items():
+            if total > 0:
+                self.logger.info(
+                    f"-> Warm connection to '{host}' on the hot path"
+                    f" {warm}/{total} times ({warm / total:.0%})."
+                )
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    # noinspection PyBroadException
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.warm()
+            except:
+                self.logger.error("-> Error while warming connections.")
+                self.logger.error(format_exc())
+            self.stopped.wait(self.config.interval)
@@ -0,0 +1,112 @@
+import logging
+
+from hashlib import blake2b
+from logging import Logger
+from requests import codes, Response, Session
+from time import monotonic
+from typing import Optional
+
+import API
+
+from config import Config
+
+
+def response_size(response: Response) -> int:
+    headers_size = sum(len(name) + len(value) + 4 for name, value in response.headers.items())
+    body_size = response.raw.tell() if response.raw is not None else len(response.content)
+    return headers_size + body_size
+
+
+class StockProbe:
+    def __init__(
+        self,
+        session: Session,
+        product_info: Config.ProductInfo,
+        force_interval: int = 60,
+        retry_interval: int = 100,
+        logger: Logger = logging
+    ):
+        self.session = session
+        self.product_info = product_info
+        self.force_interval = force_interval
+        self.retry_interval = retry_interval
+        self.logger = logger
+
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.digest: Optional[bytes] = None
+        self.supported = True
+        self.unsupported_count = 0
+        self.unchanged_count = 0
+
+        self.started_at = monotonic()
+        self.probe_count = 0
+        self.request_count = 0
+        self.byte_count = 0
+
+    def record(self, response: Response) -> None:
+        self.request_count += 1
+        self.byte_count += response_size(response)
+
+    def probe(self) -> bool:
+        self.probe_count += 1
+        if self.probe_count % 100 == 0:
+            self.log_stats()
+        # The probe's endpoint isn't documented, so once it has failed, only try it again every so often.
+        if not self.supported:
+            self.unsupported_count += 1
+            if self.unsupported_count % self.retry_interval != 0:
+                return True
+        response = API.get_product_availability(
+            session=self.session,
+            product_info=self.product_info,
+            etag=self.etag,
+            last_modified=self.last_modified,
+            logger=self.logger
+        )
+        # Closing an unread response would close its connection too, so the empty or short body is drained instead.
+        if response.status_code == codes.not_modified:
+            API.discard_body(response)
+            self.record(response)
+            return self.unchanged()
+        if not response.ok:
+            API.discard_body(response)
+            self.record(response)
+            if self.supported:
+                self.supported = False
+                self.unsupported_count = 0
+                self.logger.warning(
+                    "-> The stock probe is not supported for the product"
+                    f" [{response.status_code}]; falling back to checking out on every attempt"
+                    f" and retrying the probe every {self.retry_interval} attempts."
+                )
+            return True
+        if not self.supported:
+            self.supported = True
+            self.logger.info("-> The stock probe is supported for the product again.")
+        digest = blake2b(response.content, digest_size=16).digest()
+        self.record(response)
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        if digest == self.digest:
+            return self.unchanged()
+        self.logger.debug("-> The product's stock state has changed.")
+        self.digest = digest
+        self.unchanged_count = 0
+        return True
+
+    def unchanged(self) -> bool:
+        self.unchanged_count += 1
+        if self.unchanged_count >= self.force_interval:
+            self.logger.debug(f"-> The product's stock state is unchanged after {self.unchanged_count} probes.")
+            self.unchanged_count = 0
+            return True
+        return False
+
+    def log_stats(self) -> None:
+        hours = max(monotonic() - self.started_at, 1) / 3600
+        self.logger.info(
+            f"-> Probed stock {self.probe_count} times;"
+            f" {self.request_count / hours:.0f} requests"
+            f" and {self.byte_count / hours / 1024:.1f} KiB per product-hour."
+        )
@@ -0,0 +1,135 @@
+import logging
+import re
+import signal
+import sys
+
+from cProfile import Profile
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import Logger
+from os import makedirs, path
+from threading import Lock, Thread
+from time import monotonic, sleep, strftime
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from config import Config
+
+
+def collapse_stack(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def file_safe_name(name: str) -> str:
+    return re.sub(r"[^\w\-]+", "_", name).strip("_")
+
+
+class Profiler:
+    def __init__(
+        self,
+        config: Config.Profiler,
+        threads: Callable[[], List[Thread]],
+        logger: Logger = logging
+    ):
+        self.config = config
+        self.threads = threads
+        self.logger = logger
+
+        self.sampling_lock = Lock()
+        self.attempt_profiles: Dict[int, Profile] = {}
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    def output_path(self, thread: Thread, extension: str) -> str:
+        makedirs(self.config.output_dir, exist_ok=True)
+        return path.join(
+            self.config.output_dir,
+            f"{strftime('%Y%m%d-%H%M%S')}-{file_safe_name(thread.name)}.{extension}"
+        )
+
+    def sample(self, seconds: Optional[float] = None) -> bool:
+        if not self.sampling_lock.acquire(blocking=False):
+            self.logger.warning("-> A sampling profile is already in progress.")
+            return False
+        Thread(
+            target=self.run_sampling,
+            args=(seconds or self.config.window,),
+            name="Profiler",
+            daemon=True
+        ).start()
+        return True
+
+    def run_sampling(self, seconds: float) -> None:
+        try:
+            self.logger.info(f"-> Sampling scalper threads every {self.config.sample_interval}s for {seconds}s…")
+            threads = {x.ident: x for x in self.threads() if x.is_alive()}
+            samples = {ident: Counter() for ident in threads}
+            deadline = monotonic() + seconds
+            while monotonic() < deadline:
+                frames = sys._current_frames()
+                for ident, counter in samples.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        counter[collapse_stack(frame)] += 1
+                sleep(self.config.sample_interval)
+            for ident, counter in samples.items():
+                output_path = self.output_path(threads[ident], "folded")
+                with open(output_path, "w") as file:
+                    for stack, count in counter.most_common():
+                        file.write(f"{stack} {count}\n")
+                self.logger.info(f"-> Wrote {sum(counter.values())} samples to '{output_path}'.")
+        finally:
+            self.sampling_lock.release()
+
+    def profile_attempts(self, attempts: Optional[int] = None) -> None:
+        attempts = attempts or self.config.attempts
+        self.logger.info(f"-> Profiling the next {attempts} attempts of each scalper thread…")
+        for thread in self.threads():
+            thread.profile_attempts = attempts
+
+    def profile_attempt(self, thread: Thread, attempt: Callable[[], None]) -> None:
+        profile = self.attempt_profiles.setdefault(thread.ident, Profile())
+        profile.enable()
+        try:
+            attempt()
+        finally:
+            profile.disable()
+            thread.profile_attempts -= 1
+            if thread.profile_attempts == 0:
+                del self.attempt_profiles[thread.ident]
+                output_path = self.output_path(thread, "prof")
+                profile.dump_stats(output_path)
+                self.logger.info(f"-> Wrote the attempt profile to '{output_path}'.")
+
+    def install_signal_handlers(self) -> None:
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda *_: self.sample())
+            signal.signal(signal.SIGUSR2, lambda *_: self.profile_attempts())
+
+    def serve(self) -> None:
+        profiler = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                url = urlsplit(self.path)
+                query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                if url.path == "/profile/sample":
+                    started = profiler.sample(float(query["seconds"]) if "seconds" in query else None)
+                    self.send_response(202 if started else 409)
+                elif url.path == "/profile/attempts":
+                    profiler.profile_attempts(int(query["count"]) if "count" in query else None)
+                    self.send_response(202)
+                else:
+                    self.send_response(404)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", self.config.port), RequestHandler)
+        Thread(target=self.server.serve_forever, name="Profiler Server", daemon=True).start()
+        self.logger.info(f"-> Profiler listening on 127.0.0.1:{self.server.server_port}.")
@@ -0,0 +1,79 @@
+from argparse import ArgumentParser
+from time import localtime, strftime, time
+from typing import List
+
+from config import Config
+from deadline import percentile
+from journal import read_journal, restock_distribution, restock_times
+
+
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def histogram(labels: List[str], restock_counts: List[int], observed_counts: List[int]) -> None:
+    rates = [x / y if y > 0 else 0 for x, y in zip(restock_counts, observed_counts)]
+    max_rate = max(rates, default=0) or 1
+    for label, restock_count, observed_count, rate in zip(labels, restock_counts, observed_counts, rates):
+        print(
+            f"{label:>9}  {restock_count:5d} restocks / {observed_count:5d}h observed"
+            f"  {rate:6.3f}/h  {'#' * round(rate / max_rate * 40)}"
+        )
+
+
+def main() -> int:
+    journal_config = Config.Journal()
+    parser = ArgumentParser(description="Build restock-time distributions from the probe journal.")
+    parser.add_argument("--journal", default=journal_config.path, help="Path of the probe journal.")
+    parser.add_argument("--backup-count", type=int, default=journal_config.backup_count, help="Rotated files to read.")
+    parser.add_argument("--pid", action="append", help="Only include this product (may be repeated).")
+    parser.add_argument("--days", type=float, default=0, help="Only include the last this many days.")
+    parser.add_argument("--top", type=int, default=10, help="Number of hours of the week to list.")
+    args = parser.parse_args()
+
+    restocks, observed_hours = restock_times(read_journal(args.journal, args.backup_count))
+    if args.pid:
+        restocks = {pid: x for pid, x in restocks.items() if pid in args.pid}
+        observed_hours = {pid: x for pid, x in observed_hours.items() if pid in args.pid}
+    since = time() - args.days * 86400 if args.days > 0 else 0
+    restock_counts, observed_counts = restock_distribution(restocks, observed_hours, since=since)
+
+    for pid, timestamps in sorted(restocks.items()):
+        timestamps = [x for x in timestamps if x >= since]
+        gaps = [b - a for a, b in zip(timestamps, timestamps[1:])]
+        print(
+            f"{pid}: {len(timestamps)} restocks"
+            + (f", last at {strftime('%Y-%m-%d %H:%M', localtime(timestamps[-1]))}" if timestamps else "")
+            + (f", median gap {percentile(gaps, 50) / 3600:.1f}h" if gaps else "")
+            + "."
+        )
+
+    print("\nBy hour of the day:")
+    histogram(
+        [f"{hour:02d}:00" for hour in range(24)],
+        [sum(restock_counts[day * 24 + hour] for day in range(7)) for hour in range(24)],
+        [sum(observed_counts[day * 24 + hour] for day in range(7)) for hour in range(24)]
+    )
+
+    print("\nBy day of the week:")
+    histogram(
+        DAYS,
+        [sum(restock_counts[day * 24:day * 24 + 24]) for day in range(7)],
+        [sum(observed_counts[day * 24:day * 24 + 24]) for day in range(7)]
+    )
+
+    print(f"\nTop {args.top} hours of the week:")
+    hours = sorted(
+        [x for x in range(len(restock_counts)) if restock_counts[x] > 0],
+        key=lambda x: restock_counts[x] / max(observed_counts[x], 1),
+        reverse=True
+    )[:args.top]
+    histogram(
+        [f"{DAYS[x // 24]} {x % 24:02d}:00" for x in hours],
+        [restock_counts[x] for x in hours],
+        [observed_counts[x] for x in hours]
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
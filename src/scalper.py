@@ -1,25 +1,42 @@
 import logging
 import urllib3
 
+from contextlib import contextmanager
 from functools import cached_property
 from json.decoder import JSONDecodeError
 from requests import Session
 from requests.exceptions import Timeout
 from requests.utils import add_dict_to_cookiejar
-from threading import Thread
-from time import sleep
+from threading import Event, RLock, Thread
+from time import perf_counter
 from traceback import format_exc
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, TYPE_CHECKING
 
 import coloredlogs
 
-from pyifttt.webhook import send_notification
-from selenium.webdriver import Chrome
-from selenium.webdriver.chrome.options import Options
-
 import API
+import bandwidth
+import tracing
 
+from bandwidth import BandwidthMeter
+from basket import BasketCoordinator
+from checkout import CheckoutState, CheckoutTimer
+from completion import CompletionMonitor
 from config import Config
+from deadline import Deadline, Hedger
+from drop import DropWindow
+from journal import RestockJournal
+from ledger import PurchaseLedger
+from prewarm import Prewarmer
+from probe import StockProbe
+from profiler import Profiler
+from scheduler import PollScheduler
+from startup import StartupTimer
+from tracing import Tracer
+from watchdog import GuardedWebDriver, WebDriverHang, WebDriverWatchdog, kill_webdriver
+
+if TYPE_CHECKING:
+    from selenium.webdriver.chrome.webdriver import WebDriver
 
 
 class Scalper(Thread):
@@ -27,14 +44,20 @@ class Scalper(Thread):
         pass
 
     attempt_count = 0
+    base_required_cookies_wait = 10
     clear_cache_count = 0
+    rebootstrap_count = 0
     failure_counts = {}
+    poll_interval = 1
+    profile_attempts = 0
     session = Session()
 
     @cached_property
     def basket_id(self) -> str:
         basket_id = API.get_basket_id(
             session=self.session,
+            deadline=self.deadline,
+            hedger=self.hedger,
             logger=self.logger
         )
         self.logger.info("-> Got the basket ID.")
@@ -46,6 +69,7 @@ class Scalper(Thread):
         store_currys = API.get_store_currys(
             session=self.session,
             user_info=self.user_info,
+            deadline=self.deadline,
             logger=self.logger
         )
         if store_currys is None:
@@ -58,11 +82,23 @@ class Scalper(Thread):
     def base_required_cookies(self) -> Dict[str, Optional[str]]:
         base_required_cookies = API.get_base_required_cookies(
             webdriver=self.webdriver,
+            wait=self.base_required_cookies_wait,
             logger=self.logger
         )
         self.logger.info("-> Got the base required cookies.")
+        API.preposition_webdriver(
+            webdriver=self.webdriver,
+            logger=self.logger
+        )
         return base_required_cookies
 
+    @property
+    def webdriver(self) -> "WebDriver":
+        with self.webdriver_lock:
+            if self.chrome_webdriver is None:
+                self.init_chrome_webdriver()
+            return GuardedWebDriver(self.chrome_webdriver, self.watchdog, on_hang=self.recycle_webdriver)
+
     @cached_property
     def required_cookies(self) -> Dict[str, Optional[str]]:
         return self.base_required_cookies | {"store-currys": self.store_currys}
@@ -75,16 +111,65 @@ class Scalper(Thread):
         product_info: Config.ProductInfo,
         user_info: Config.UserInfo,
         max_product_name_length: int,
+        prewarmer: Optional[Prewarmer] = None,
+        basket_coordinator: Optional[BasketCoordinator] = None,
+        ledger: Optional[PurchaseLedger] = None,
+        profiler: Optional[Profiler] = None,
+        startup_timer: Optional[StartupTimer] = None,
+        hedger: Optional[Hedger] = None,
+        journal: Optional[RestockJournal] = None,
+        scheduler: Optional[PollScheduler] = None,
+        watchdog: Optional[WebDriverWatchdog] = None,
+        tracer: Optional[Tracer] = None,
+        bandwidth_meter: Optional[BandwidthMeter] = None
     ):
-        super().__init__()
+        super().__init__(name=f"Scalper {product_info.pid}")
         self.config = config
         self.ifttt_config = ifttt_config
         self.payment_info = payment_info
         self.product_info = product_info
         self.user_info = user_info
-
-        self.webdriver = None
-        self.init_chrome_webdriver()
+        self.prewarmer = prewarmer
+        self.basket_coordinator = basket_coordinator or BasketCoordinator([product_info])
+        self.ledger = ledger or PurchaseLedger(config.ledger_path)
+        self.profiler = profiler
+        self.startup_timer = startup_timer
+        self.hedger = hedger
+        self.journal = journal
+        self.scheduler = scheduler
+        self.watchdog = watchdog
+        self.tracer = tracer
+        self.bandwidth_meter = bandwidth_meter
+        self.deadline = None
+        self.completion_monitor = None
+        self.retired = False
+        self.preparation_requested = False
+        self.awaiting_merge = False
+        self.woken = Event()
+
+        self.in_stock = False
+        self.stock_changed = False
+        self.response = None
+        self.basket = None
+        self.kept_products = {}
+        self.checkout_state = CheckoutState.ADD_PRODUCT
+        self.checkout_timer = CheckoutTimer()
+        self.checkout_steps = {
+            CheckoutState.ADD_PRODUCT: self.step_add_product,
+            CheckoutState.SET_QUANTITY: self.step_set_quantity,
+            CheckoutState.CLEAN_BASKET: self.step_clean_basket,
+            CheckoutState.SET_DELIVERY_METHOD: self.step_set_delivery_method,
+            CheckoutState.GET_CONSIGNMENTS: self.step_get_consignments,
+            CheckoutState.SET_DELIVERY_SLOTS: self.step_set_delivery_slots,
+            CheckoutState.APPLY_OFFER_CODES: self.step_apply_offer_codes,
+            CheckoutState.INVALIDATE_PAYMENT_REQUESTS: self.step_invalidate_payment_requests,
+            CheckoutState.CREATE_ORDER: self.step_create_order,
+            CheckoutState.CREATE_PAYMENT_REQUEST: self.step_create_payment_request,
+            CheckoutState.SUBMIT_PAYMENT: self.step_submit_payment
+        }
+
+        self.chrome_webdriver = None
+        self.webdriver_lock = RLock()
 
         if not self.config.ssl_verify:
             self.session.verify = False
@@ -108,6 +193,22 @@ class Scalper(Thread):
             logger=self.logger)
         logging.addLevelName(35, "SUCCESS")
 
+        # The default hedger and watchdog log through the scalper's logger, rather than configuring the root logger.
+        if self.hedger is None:
+            self.hedger = Hedger(hedge_percentile=config.hedge_percentile, logger=self.logger)
+        if self.watchdog is None:
+            self.watchdog = WebDriverWatchdog(Config.Watchdog(), logger=self.logger)
+
+        self.stock_probe = StockProbe(
+            session=self.session,
+            product_info=self.product_info,
+            force_interval=self.config.probe_force_interval,
+            logger=self.logger
+        )
+        self.drop_window = None
+        if product_info.drop is not None:
+            self.drop_window = DropWindow(product_info.drop, session=self.session, logger=self.logger)
+
     def clear_cache(self, clear_all_cookies: bool = False) -> None:
         self.logger.debug(f"-> Clearing cache (clear_all_cookies={clear_all_cookies})…")
         self.clear_cache_count += 1
@@ -121,26 +222,181 @@ class Scalper(Thread):
             del self.__dict__["required_cookies"]
         should_clear_all_cookies = clear_all_cookies or self.clear_cache_count % 100 == 0
         if should_clear_all_cookies and "base_required_cookies" in self.__dict__:
+            self.rebootstrap_count += 1
             del self.__dict__["base_required_cookies"]
             self.webdriver.delete_all_cookies()
         self.failure_counts = {}
         self.session.cookies.clear()
+        self.reset_checkout()
 
     def init_chrome_webdriver(self) -> None:
-        if self.webdriver is not None:
-            self.webdriver.quit()
-        options = Options()
-        options.add_argument("--headless")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--no-sandbox")
-        self.webdriver = Chrome(self.config.chromedriver_location, options=options)
+        from selenium.webdriver import Chrome
+        from selenium.webdriver.chrome.options import Options
+
+        with self.webdriver_lock:
+            if self.chrome_webdriver is not None:
+                try:
+                    GuardedWebDriver(
+                        self.chrome_webdriver,
+                        self.watchdog,
+                        on_hang=lambda webdriver: kill_webdriver(webdriver, logger=self.logger)
+                    ).quit()
+                except WebDriverHang:
+                    pass
+            self.chrome_webdriver = None
+            started_at = perf_counter()
+            options = Options()
+            options.add_argument("--headless")
+            options.add_argument("--disable-gpu")
+            options.add_argument("--disable-dev-shm-usage")
+            options.add_argument("--no-sandbox")
+            abandoned = Event()
+
+            def launch() -> "WebDriver":
+                webdriver = Chrome(self.config.chromedriver_location, options=options)
+                webdriver.set_page_load_timeout(self.watchdog.config.page_load_timeout)
+                webdriver.set_script_timeout(self.watchdog.config.script_timeout)
+                # A launch which finishes after the watchdog has given up on it would otherwise leak its browser.
+                if abandoned.is_set():
+                    kill_webdriver(webdriver, logger=self.logger)
+                    raise WebDriverHang("The Chrome webdriver launched after the watchdog gave up on it.")
+                return webdriver
+
+            # The lock is held while launching, so a hung launch mustn't block every later use of the webdriver.
+            self.chrome_webdriver = self.watchdog.call("launch", launch, on_hang=abandoned.set)
+            self.logger.debug(f"-> Launched the Chrome webdriver in {perf_counter() - started_at:.3f}s.")
+
+    # noinspection PyBroadException
+    def recycle_webdriver(self, webdriver: "WebDriver") -> None:
+        hung_at = perf_counter()
+        kill_webdriver(webdriver, logger=self.logger)
+        with self.webdriver_lock:
+            if self.chrome_webdriver is not webdriver:
+                return
+            self.chrome_webdriver = None
+
+        def relaunch() -> None:
+            try:
+                _ = self.webdriver.current_url
+            except:
+                self.logger.error("-> Failed to relaunch the Chrome webdriver after a hang.")
+                self.logger.error(format_exc())
+                return
+            self.watchdog.record_recovery(perf_counter() - hung_at)
+
+        Thread(target=relaunch, name=f"{self.name} Browser", daemon=True).start()
+
+    # noinspection PyBroadException
+    def launch_browser_in_background(self) -> None:
+        def launch() -> None:
+            try:
+                _ = self.webdriver
+            except:
+                self.logger.error("-> Failed to launch the Chrome webdriver in the background.")
+                self.logger.error(format_exc())
+                return
+            if self.startup_timer is not None:
+                self.startup_timer.milestone("browser_ready")
+
+        Thread(target=launch, name=f"{self.name} Browser", daemon=True).start()
 
     def notify(self) -> None:
+        from pyifttt.webhook import send_notification
+
         if self.ifttt_config.key:
             for event_name in self.ifttt_config.webhook_event_names:
                 send_notification(event_name, dict(value1=self.product_info.name), self.ifttt_config.key)
 
+    def probe(self) -> bool:
+        changed = self.stock_probe.probe()
+        if self.journal is not None:
+            self.journal.record_probe(self.product_info.pid)
+        if self.stock_probe.probe_count == 1 and self.startup_timer is not None:
+            self.startup_timer.milestone("first_probe")
+        return changed
+
+    def monitor_completion(self, product_infos: List[Config.ProductInfo]) -> None:
+        purchases = [(x, self.ledger.remaining_quantity(x)) for x in product_infos]
+        pids = [x.pid for x in product_infos]
+
+        def on_outcome(outcome: str) -> None:
+            if self.config.dry_run:
+                completion_monitor.stop()
+                self.basket_coordinator.end_completion(pids)
+                self.logger.info(f"-> Finished the dry run's completion window ({outcome}); resuming…")
+            elif outcome == CompletionMonitor.SUCCESS:
+                for product_info, quantity in purchases:
+                    self.ledger.record(product_info, quantity)
+                self.basket_coordinator.end_completion(pids)
+                self.logger.log(
+                    35,
+                    f"-> SUCCESS! Confirmed the purchase of {len(purchases)}"
+                    f" {'product' if len(purchases) == 1 else 'products'}; recorded it in the ledger."
+                )
+            elif outcome == CompletionMonitor.FAILURE:
+                self.basket_coordinator.end_completion(pids)
+                self.logger.error("-> The purchase failed; resuming…")
+            else:
+                # Checking out again while the payment may still be approved risks buying the products twice.
+                self.logger.error(
+                    f"-> The purchase was not confirmed within {self.config.completion_timeout:.0f} seconds;"
+                    " keeping the products pending until the browser or the basket confirms its outcome."
+                    " Restart the bot to check them out again if it has failed."
+                )
+
+        self.basket_coordinator.begin_completion(pids)
+        completion_monitor = CompletionMonitor(
+            webdriver=self.webdriver,
+            session=self.session,
+            basket_id=self.basket_id,
+            on_outcome=on_outcome,
+            timeout=self.config.completion_timeout,
+            logger=self.logger
+        )
+        self.completion_monitor = completion_monitor
+        completion_monitor.start()
+
+    def request_preparation(self) -> None:
+        self.preparation_requested = True
+        self.woken.set()
+
+    def prepare(self) -> None:
+        self.preparation_requested = False
+        self.deadline = Deadline(self.config.attempt_deadline)
+        _ = self.required_cookies
+        _ = self.basket_id
+        API.preposition_webdriver(
+            webdriver=self.webdriver,
+            logger=self.logger
+        )
+        self.logger.info("-> Prepared the session and browser.")
+
+    def prepare_for_drop(self) -> None:
+        self.drop_window.prepared = True
+        self.logger.info(f"-> Preparing for the drop in {self.drop_window.seconds_until_release():.0f}s…")
+        self.clear_cache()
+        self.prepare()
+        if self.prewarmer is not None:
+            self.prewarmer.warm()
+        self.drop_window.synchronise_clock()
+
+    def next_poll_interval(self) -> float:
+        poll_interval = self.poll_interval
+        if self.scheduler is not None:
+            poll_interval = self.scheduler.poll_interval() or poll_interval
+        if self.drop_window is not None:
+            poll_interval = self.drop_window.poll_interval(poll_interval) or poll_interval
+        return poll_interval
+
+    def retire(self) -> None:
+        self.retired = True
+        self.basket_coordinator.report_out_of_stock(self.product_info.pid)
+        self.logger.log(
+            35,
+            f"-> Purchased the full quantity ({self.product_info.quantity}) of the product;"
+            " retiring the scalper."
+        )
+
     def sorted_delivery_slots(
         self,
         delivery_slots: List[Dict[str, Any]],
@@ -165,289 +421,519 @@ class Scalper(Thread):
         else:
             self.logger.error(f"-> Unknown delivery method '{delivery_sort_method}'.")
 
-    def scalp(self) -> None:
-        self.attempt_count += 1
-        self.logger.info(f"Attempt #{self.attempt_count}…")
-
-        if self.attempt_count % 10000 == 0:
-            self.init_chrome_webdriver()
+    @property
+    def kept_product_infos(self) -> List[Config.ProductInfo]:
+        return [
+            self.basket_coordinator.product_infos.get(pid, self.product_info)
+            for pid in self.kept_products
+        ]
 
-        response = None
-        try:
-            # Add the required cookies to the current requests session.
-            self.session.cookies.clear()
-            add_dict_to_cookiejar(self.session.cookies, self.required_cookies)
+    def reset_checkout(self) -> None:
+        self.checkout_state = CheckoutState.ADD_PRODUCT
+        self.basket = None
+        self.kept_products = {}
 
-            # Add the product to the basket.
-            response = API.add_product(
-                session=self.session,
-                product_info=self.product_info,
-                logger=self.logger
+    def resume_checkout_state(self) -> CheckoutState:
+        self.response = API.get_basket(
+            session=self.session,
+            basket_id=self.basket_id,
+            deadline=self.deadline,
+            hedger=self.hedger,
+            logger=self.logger
+        )
+        if not self.response.ok:
+            self.logger.warning(
+                "-> Failed to check the basket; restarting the checkout"
+                f" [{self.response.status_code}]."
             )
-            if not response.ok:
-                failure_count = self.failure_counts.get("add_to_basket", 0) + 1
-                self.failure_counts["add_to_basket"] = failure_count
-                self.logger.error(
-                    "-> Failed to add the product to the basket"
-                    f" {failure_count} time{'' if failure_count == 1 else 's'}"
-                    f" [{response.status_code}]."
-                )
-                if failure_count >= 10:
-                    self.clear_cache()
-                return
-            self.logger.info("-> Added the product to the basket.")
-
-            # Set the quantity of the product in the basket.
-            response = API.set_quantity(
+            return CheckoutState.ADD_PRODUCT
+        self.basket = self.response.json()["payload"]
+        products = {x["id"]: x for x in self.basket["products"]}
+        product = products.get(self.product_info.pid)
+        if product is None:
+            return CheckoutState.ADD_PRODUCT
+        state = self.checkout_state
+        if state is CheckoutState.SUBMIT_PAYMENT:
+            state = CheckoutState.INVALIDATE_PAYMENT_REQUESTS
+        quantity = product.get("quantity")
+        if set(products) != set(self.kept_products) or (
+            quantity is not None and quantity != self.ledger.remaining_quantity(self.product_info)
+        ):
+            return min(state, CheckoutState.SET_QUANTITY)
+        if any(x["fulfilmentChannel"] != "home-delivery" for x in products.values()):
+            return min(state, CheckoutState.SET_DELIVERY_METHOD)
+        consignments = self.basket["consignments"]
+        if len(consignments) == 0 or any(
+            not x["isReadyForDelivery"] or x["deliverySlot"] is None
+            for x in consignments
+        ):
+            return min(state, CheckoutState.GET_CONSIGNMENTS)
+        return state
+
+    def run_checkout_state(self) -> bool:
+        state = self.checkout_state
+        started_at = perf_counter()
+        with tracing.span(f"checkout.{state.label}") as state_span:
+            try:
+                next_state = self.checkout_steps[state]()
+            finally:
+                self.checkout_timer.record(state, perf_counter() - started_at)
+            if next_state is None and state_span is not None:
+                state_span.set_error("stalled")
+        if next_state is None:
+            self.checkout_timer.record_stall(state)
+            self.logger.debug(f"-> The checkout stalled in state '{state.label}'.")
+            return False
+        self.checkout_state = next_state
+        return True
+
+    def step_add_product(self) -> Optional[CheckoutState]:
+        # Stock probes keep 'api.currys.co.uk' warm themselves, so the checkout's first host is measured instead.
+        if self.prewarmer is not None:
+            self.prewarmer.record_hot_path("https://www.currys.co.uk/")
+        self.response = API.add_product(
+            session=self.session,
+            product_info=self.product_info,
+            deadline=self.deadline,
+            logger=self.logger
+        )
+        self.stock_probe.record(self.response)
+        self.stock_changed = False
+        self.in_stock = self.response.ok
+        if self.journal is not None:
+            self.journal.record_stock(self.product_info.pid, self.in_stock)
+        if not self.response.ok:
+            self.basket_coordinator.report_out_of_stock(self.product_info.pid)
+            failure_count = self.failure_counts.get("add_to_basket", 0) + 1
+            self.failure_counts["add_to_basket"] = failure_count
+            self.logger.error(
+                "-> Failed to add the product to the basket"
+                f" {failure_count} time{'' if failure_count == 1 else 's'}"
+                f" [{self.response.status_code}]."
+            )
+            if failure_count >= 10:
+                self.clear_cache()
+            return None
+        self.logger.info("-> Added the product to the basket.")
+        if self.drop_window is not None:
+            self.drop_window.record_added()
+        self.basket_coordinator.report_in_stock(self.product_info.pid)
+        return CheckoutState.SET_QUANTITY
+
+    def step_set_quantity(self) -> Optional[CheckoutState]:
+        # Set the quantity of any other in-stock products merged into the basket.
+        for product_info in self.basket_coordinator.wanted_product_infos():
+            if product_info.pid == self.product_info.pid:
+                continue
+            self.response = API.set_quantity(
                 session=self.session,
-                product_info=self.product_info,
+                product_info=self.ledger.remaining_product_info(product_info),
                 basket_id=self.basket_id,
+                deadline=self.deadline,
+                hedger=self.hedger,
+                read_body=False,
                 logger=self.logger
             )
-            if not response.ok:
-                failure_count = self.failure_counts.get("set_quantity", 0) + 1
-                self.failure_counts["set_quantity"] = failure_count
-                self.logger.error(
-                    "-> Failed to set the quantity of the product"
-                    f" {failure_count} in the basket time{'' if failure_count == 1 else 's'}"
-                    f" [{response.status_code}]."
+            if not self.response.ok:
+                self.logger.warning(
+                    f"-> Failed to set the quantity of merged product '{product_info.name}' ({product_info.pid})"
+                    f" in the basket [{self.response.status_code}]."
                 )
-                if failure_count >= 10:
-                    self.clear_cache()
-                return
-            self.logger.info(f"-> Set the quantity of the product in the basket to {self.product_info.quantity}.")
-
-            # Delete any other products from the basket, getting the current one in the process.
-            current_product = None
-            products = response.json()["payload"]["products"]
-            different_products = len(products)
-            self.logger.info(
-                f"-> The basket contains {different_products}"
-                f" {'type of product' if different_products == 1 else 'types of products'}."
+
+        # Set the quantity of the product in the basket.
+        self.response = API.set_quantity(
+            session=self.session,
+            product_info=self.ledger.remaining_product_info(self.product_info),
+            basket_id=self.basket_id,
+            deadline=self.deadline,
+            hedger=self.hedger,
+            logger=self.logger
+        )
+        if not self.response.ok:
+            failure_count = self.failure_counts.get("set_quantity", 0) + 1
+            self.failure_counts["set_quantity"] = failure_count
+            self.logger.error(
+                "-> Failed to set the quantity of the product"
+                f" {failure_count} in the basket time{'' if failure_count == 1 else 's'}"
+                f" [{self.response.status_code}]."
             )
-            for product in products:
-                if product["id"] == self.product_info.pid:
-                    self.logger.info(
-                        f"-> The product costs {float(product['price']['amountWithVat']) / 100:.2f}"
-                        f" {product['price']['currency']}."
-                    )
-                    current_product = product
-                else:
-                    self.logger.debug(f"-> Attempting to delete product '{product['title']}' ({product['id']})…")
-                    response = API.delete_product(
-                        session=self.session,
-                        product_info=Config.ProductInfo(product["title"], product["id"], 1),
-                        basket_id=self.basket_id,
-                        logger=self.logger
-                    )
-                    if not response.ok:
-                        self.logger.error(
-                            f"-> Failed to delete product '{product['title']}' ({product['id']})"
-                            f" [{response.status_code}]."
-                        )
-                        return
-                    self.logger.info(
-                        f"-> Deleted product '{product['title']}' ({product['id']})"
-                        " from the basket."
+            if failure_count >= 10:
+                self.clear_cache()
+            return None
+        self.logger.info(
+            "-> Set the quantity of the product in the basket to"
+            f" {self.ledger.remaining_quantity(self.product_info)}."
+        )
+        self.basket = self.response.json()["payload"]
+        return CheckoutState.CLEAN_BASKET
+
+    def step_clean_basket(self) -> Optional[CheckoutState]:
+        # Delete any products from the basket which are not wanted, keeping any merged in-stock products.
+        self.kept_products = {}
+        products = self.basket["products"]
+        different_products = len(products)
+        self.logger.info(
+            f"-> The basket contains {different_products}"
+            f" {'type of product' if different_products == 1 else 'types of products'}."
+        )
+        for product in products:
+            if product["id"] == self.product_info.pid or self.basket_coordinator.is_wanted(product["id"]):
+                self.logger.info(
+                    f"-> Product '{product['title']}' ({product['id']}) costs"
+                    f" {float(product['price']['amountWithVat']) / 100:.2f}"
+                    f" {product['price']['currency']}."
+                )
+                self.kept_products[product["id"]] = product
+            else:
+                self.logger.debug(f"-> Attempting to delete product '{product['title']}' ({product['id']})…")
+                self.response = API.delete_product(
+                    session=self.session,
+                    product_info=Config.ProductInfo(product["title"], product["id"], 1),
+                    basket_id=self.basket_id,
+                    deadline=self.deadline,
+                    logger=self.logger
+                )
+                if not self.response.ok:
+                    self.logger.error(
+                        f"-> Failed to delete product '{product['title']}' ({product['id']})"
+                        f" [{self.response.status_code}]."
                     )
-            if current_product is None:
-                self.logger.error("-> Failed to locate the product in the basket.")
-                return
-
-            # Set the delivery method of the basket.
-            home_delivery_set = current_product["fulfilmentChannel"] == "home-delivery"
+                    return None
+                self.logger.info(
+                    f"-> Deleted product '{product['title']}' ({product['id']})"
+                    " from the basket."
+                )
+        if self.product_info.pid not in self.kept_products:
+            self.logger.error("-> Failed to locate the product in the basket.")
+            return None
+        if len(self.kept_products) > 1:
+            self.logger.info(f"-> Merged {len(self.kept_products) - 1} other in-stock products into the checkout.")
+        return CheckoutState.SET_DELIVERY_METHOD
+
+    def step_set_delivery_method(self) -> Optional[CheckoutState]:
+        # Set the delivery method of the products in the basket.
+        for product_info in self.kept_product_infos:
+            home_delivery_set = self.kept_products[product_info.pid]["fulfilmentChannel"] == "home-delivery"
             if not home_delivery_set:
-                response = API.set_home_delivery(
+                self.response = API.set_home_delivery(
                     session=self.session,
-                    product_info=self.product_info,
+                    product_info=product_info,
                     basket_id=self.basket_id,
+                    deadline=self.deadline,
+                    hedger=self.hedger,
                     logger=self.logger
                 )
-                if not response.ok:
+                if not self.response.ok:
                     self.logger.error(
-                        "-> Failed to set delivery method for the product"
-                        f" [{response.status_code}]."
+                        f"-> Failed to set delivery method for product '{product_info.name}'"
+                        f" [{self.response.status_code}]."
                     )
-                    return
-                self.logger.info("-> Selected home delivery for the product.")
+                    return None
+                self.kept_products[product_info.pid]["fulfilmentChannel"] = "home-delivery"
+                self.logger.info(f"-> Selected home delivery for product '{product_info.name}'.")
             else:
                 self.logger.info(
-                    "-> The product already has delivery method set;"
+                    f"-> Product '{product_info.name}' already has delivery method set;"
                     " selected home delivery for the product."
                 )
+        return CheckoutState.GET_CONSIGNMENTS
 
-            # Get any consignments for the basket.
-            response = API.get_consignments(
-                session=self.session,
-                user_info=self.user_info,
-                basket_id=self.basket_id,
-                logger=self.logger
+    def step_get_consignments(self) -> Optional[CheckoutState]:
+        # Get any consignments for the basket.
+        self.response = API.get_consignments(
+            session=self.session,
+            user_info=self.user_info,
+            basket_id=self.basket_id,
+            deadline=self.deadline,
+            logger=self.logger
+        )
+        if not self.response.ok:
+            self.logger.error(
+                "-> Failed to get consignments for the basket"
+                f" [{self.response.status_code}]."
             )
-            if not response.ok:
-                self.logger.error(
-                    "-> Failed to get consignments for the basket"
-                    f" [{response.status_code}]."
+            return None
+        self.basket = self.response.json()["payload"]
+        if len(self.basket["consignments"]) < 1:
+            self.logger.error("-> No consignments available for the basket.")
+            return None
+        self.logger.info("-> Got consignments for the basket.")
+        return CheckoutState.SET_DELIVERY_SLOTS
+
+    def step_set_delivery_slots(self) -> Optional[CheckoutState]:
+        # Set the delivery slots for the consignments if needed.
+        for consignment in self.basket["consignments"]:
+            consignment_type = consignment["id"]["type"]
+            if not consignment["isReadyForDelivery"] or consignment["deliverySlot"] is None:
+                delivery_slots = consignment["availableDeliverySlots"]
+                if len(consignment["availableDeliverySlots"]) == 0:
+                    self.logger.error(f"-> No delivery slots available for consignment '{consignment_type}'.")
+                    return None
+                self.logger.info(f"-> Got delivery slots for consignment '{consignment_type}'.")
+
+                sorted_delivery_slots = self.sorted_delivery_slots(
+                    delivery_slots=delivery_slots,
+                    delivery_sort_method=self.config.delivery_sort_method
                 )
-                return
-            consignments = response.json()["payload"]["consignments"]
-            if len(consignments) < 1:
-                self.logger.error("-> No consignments available for the basket.")
-                return
-            self.logger.info("-> Got consignments for the basket.")
-
-            # Set the delivery slots for the consignments if needed.
-            for consignment in consignments:
-                consignment_type = consignment["id"]["type"]
-                if not consignment["isReadyForDelivery"] or consignment["deliverySlot"] is None:
-                    delivery_slots = consignment["availableDeliverySlots"]
-                    if len(consignment["availableDeliverySlots"]) == 0:
-                        self.logger.error(f"-> No delivery slots available for consignment '{consignment_type}'.")
-                        return
-                    self.logger.info(f"-> Got delivery slots for consignment '{consignment_type}'.")
-
+                if len(sorted_delivery_slots) == 0:
+                    self.logger.error(
+                        f"-> No delivery slots available for consignment '{consignment_type}'"
+                        f" with delivery sort method {self.config.delivery_sort_method}."
+                    )
                     sorted_delivery_slots = self.sorted_delivery_slots(
                         delivery_slots=delivery_slots,
-                        delivery_sort_method=self.config.delivery_sort_method
-                    )
-                    if len(sorted_delivery_slots) == 0:
-                        self.logger.error(
-                            f"-> No delivery slots available for consignment '{consignment_type}'"
-                            f" with delivery sort method {self.config.delivery_sort_method}."
-                        )
-                        sorted_delivery_slots = self.sorted_delivery_slots(
-                            delivery_slots=delivery_slots,
-                            delivery_sort_method="price_low_high"
-                        )
-
-                    delivery_slot = sorted_delivery_slots[0]
-                    response = API.set_delivery_slot(
-                        session=self.session,
-                        consignment_type=consignment_type,
-                        delivery_slot=delivery_slot,
-                        basket_id=self.basket_id,
-                        logger=self.logger
-                    )
-                    if not response.ok:
-                        self.logger.error(
-                            f"-> Failed to set delivery slot for consignment '{consignment_type}'"
-                            f" [{response.status_code}]."
-                        )
-                        return
-                    self.logger.info(
-                        f"-> Selected delivery slot for consignment '{consignment_type}'"
-                        f" on {delivery_slot['date']} @ {delivery_slot['timeSlot']}"
-                        f" costs {float(delivery_slot['price']['amountWithVat']) / 100:.2f}"
-                        f" {delivery_slot['price']['currency']}."
+                        delivery_sort_method="price_low_high"
                     )
-                else:
-                    delivery_slot = consignment["deliverySlot"]
-                    self.logger.info(
-                        f"-> Consignment '{consignment_type}' is ready for delivery;"
-                        f" selected delivery slot on {delivery_slot['date']} @ {delivery_slot['timeSlot']}"
-                        f" costs {float(delivery_slot['price']['amountWithVat']) / 100:.2f}"
-                        f" {delivery_slot['price']['currency']}."
+
+                delivery_slot = sorted_delivery_slots[0]
+                self.response = API.set_delivery_slot(
+                    session=self.session,
+                    consignment_type=consignment_type,
+                    delivery_slot=delivery_slot,
+                    basket_id=self.basket_id,
+                    deadline=self.deadline,
+                    logger=self.logger
+                )
+                if not self.response.ok:
+                    self.logger.error(
+                        f"-> Failed to set delivery slot for consignment '{consignment_type}'"
+                        f" [{self.response.status_code}]."
                     )
+                    return None
+                self.logger.info(
+                    f"-> Selected delivery slot for consignment '{consignment_type}'"
+                    f" on {delivery_slot['date']} @ {delivery_slot['timeSlot']}"
+                    f" costs {float(delivery_slot['price']['amountWithVat']) / 100:.2f}"
+                    f" {delivery_slot['price']['currency']}."
+                )
+                self.basket = self.response.json()["payload"]
+            else:
+                delivery_slot = consignment["deliverySlot"]
+                self.logger.info(
+                    f"-> Consignment '{consignment_type}' is ready for delivery;"
+                    f" selected delivery slot on {delivery_slot['date']} @ {delivery_slot['timeSlot']}"
+                    f" costs {float(delivery_slot['price']['amountWithVat']) / 100:.2f}"
+                    f" {delivery_slot['price']['currency']}."
+                )
+        return CheckoutState.APPLY_OFFER_CODES
+
+    def step_apply_offer_codes(self) -> Optional[CheckoutState]:
+        # Apply any offer codes for the products to the basket if provided.
+        for product_info in self.kept_product_infos:
+            if product_info.offer_code == "":
+                continue
+            self.response = API.apply_offer_code(
+                session=self.session,
+                product_info=product_info,
+                basket_id=self.basket_id,
+                deadline=self.deadline,
+                logger=self.logger
+            )
+            if not self.response.ok:
+                self.logger.warning(
+                    f"-> Failed to apply offer code '{product_info.offer_code}'"
+                    f" for product '{product_info.name}' to the basket"
+                    f" [{self.response.status_code}]."
+                )
+            else:
+                self.basket = self.response.json()["payload"]
+                discount = self.basket["totalDiscountAmount"]
+                self.logger.info(
+                    f"-> Applied offer code '{product_info.offer_code}'"
+                    f" for product '{product_info.name}' to the basket;"
+                    f" {float(discount['amountWithVat']) / 100:.2f}"
+                    f" {discount['currency']} discount applied."
+                )
+        return CheckoutState.INVALIDATE_PAYMENT_REQUESTS
 
-            # Apply an offer code to the basket if provided.
-            if self.product_info.offer_code != "":
-                _response = response
-                response = API.apply_offer_code(
+    def step_invalidate_payment_requests(self) -> Optional[CheckoutState]:
+        # Invalidate any existing payment requests for the basket.
+        for payment_request in self.basket["paymentRequests"]:
+            if payment_request["status"] != "failed":
+                self.response = API.invalidate_payment_request(
                     session=self.session,
-                    product_info=self.product_info,
+                    payment_request_id=payment_request["id"],
                     basket_id=self.basket_id,
+                    deadline=self.deadline,
                     logger=self.logger
                 )
-                if not response.ok:
+                if not self.response.ok:
                     self.logger.warning(
-                        f"-> Failed to apply offer code '{self.product_info.offer_code}'"
-                        " for the product to the basket"
-                        f" [{response.status_code}]."
-                    )
-                    response = _response
-                else:
-                    discount = response.json()["payload"]["totalDiscountAmount"]
-                    self.logger.info(
-                        f"-> Applied offer code '{self.product_info.offer_code}'"
-                        " for the product to the basket;"
-                        f" {float(discount['amountWithVat']) / 100:.2f}"
-                        f" {discount['currency']} discount applied."
+                        f"-> Failed to invalidate payment request '{payment_request['id']}'"
+                        " for the basket"
+                        f" [{self.response.status_code}]."
                     )
+                self.logger.info(
+                    f"-> Invalidated payment request '{payment_request['id']}'"
+                    " for the basket."
+                )
+        return CheckoutState.CREATE_ORDER
 
-            # Invalidate any existing payment requests for the basket.
-            for payment_request in response.json()["payload"]["paymentRequests"]:
-                if payment_request["status"] != "failed":
-                    response = API.invalidate_payment_request(
-                        session=self.session,
-                        payment_request_id=payment_request["id"],
-                        basket_id=self.basket_id,
-                        logger=self.logger
-                    )
-                    if not response.ok:
-                        self.logger.warning(
-                            f"-> Failed to invalidate payment request '{payment_request['id']}'"
-                            " for the basket"
-                            f" [{response.status_code}]."
-                        )
-                    self.logger.info(
-                        f"-> Invalidated payment request '{payment_request['id']}'"
-                        " for the basket."
-                    )
+    def step_create_order(self) -> Optional[CheckoutState]:
+        # Check that no other product has been merged into the basket since it was cleaned.
+        self.response = API.get_basket(
+            session=self.session,
+            basket_id=self.basket_id,
+            deadline=self.deadline,
+            hedger=self.hedger,
+            logger=self.logger
+        )
+        if not self.response.ok:
+            self.logger.error(
+                "-> Failed to check the basket before creating the order"
+                f" [{self.response.status_code}]."
+            )
+            return None
+        products = {x["id"] for x in self.response.json()["payload"]["products"]}
+        if products != set(self.kept_products):
+            self.logger.warning(
+                "-> The basket's products have changed since it was cleaned;"
+                " merging or deleting them before creating the order."
+            )
+            return CheckoutState.SET_QUANTITY
 
-            # Create an order for the basket.
-            response = API.create_order(
-                session=self.session,
-                basket_id=self.basket_id,
-                logger=self.logger
+        # Create an order for the basket.
+        self.response = API.create_order(
+            session=self.session,
+            basket_id=self.basket_id,
+            deadline=self.deadline,
+            logger=self.logger
+        )
+        if not self.response.ok:
+            self.logger.error(
+                "-> Failed to create order for the basket"
+                f" [{self.response.status_code}]."
             )
-            if not response.ok:
-                self.logger.error(
-                    "-> Failed to create order for the basket"
-                    f" [{response.status_code}]."
+            return None
+        self.logger.info("-> Created order for the basket.")
+        return CheckoutState.CREATE_PAYMENT_REQUEST
+
+    def step_create_payment_request(self) -> Optional[CheckoutState]:
+        # Create a payment request for the basket.
+        self.response = API.create_payment_request(
+            session=self.session,
+            basket_id=self.basket_id,
+            deadline=self.deadline,
+            logger=self.logger
+        )
+        if not self.response.ok:
+            self.logger.error(
+                "-> Failed to create payment request for the basket"
+                f" [{self.response.status_code}]."
+            )
+            return None
+        self.logger.info("-> Created payment request for the basket.")
+        self.basket = self.response.json()["payload"]
+        return CheckoutState.SUBMIT_PAYMENT
+
+    def step_submit_payment(self) -> Optional[CheckoutState]:
+        # Submit the payment requests for the basket.
+        for payment_request in self.basket["paymentRequests"]:
+            if payment_request["status"] == "new":
+                if self.prewarmer is not None:
+                    self.prewarmer.record_hot_path(payment_request["paymentMethodRequestData"]["payment_url"])
+                self.response = API.submit_payment(
+                    session=self.session,
+                    payment_info=self.payment_info,
+                    payment_url=payment_request["paymentMethodRequestData"]["payment_url"],
+                    webdriver=self.webdriver,
+                    notify=self.notify,
+                    dry_run=self.config.dry_run,
+                    deadline=self.deadline,
+                    logger=self.logger
                 )
+                self.logger.info("-> Submitted payment for the basket.")
+                if self.response is None:
+                    self.logger.log(
+                        35,
+                        "-> SUCCESS?"
+                        " Please check for any 3D Secure authentication prompts from your payment method;"
+                        f" monitoring completion for {self.config.completion_timeout:.0f} seconds…"
+                    )
+                    self.basket_coordinator.record_checkout(self.kept_products)
+                    self.hedger.record_checkout(self.deadline.budget - self.deadline.remaining())
+                    self.monitor_completion(self.kept_product_infos)
+                    return CheckoutState.COMPLETE
+                else:
+                    self.logger.error(
+                        f"-> Failed to submit payment due to an invalid response from {self.response.url}"
+                        f" [{self.response.status_code}]."
+                    )
+        return None
+
+    def scalp(self) -> None:
+        if self.basket_coordinator.is_pending(self.product_info.pid):
+            if self.awaiting_merge:
+                self.awaiting_merge = False
+                self.logger.info("-> Another product's checkout merged the product into the basket.")
+            self.logger.debug("-> Waiting for a submitted payment for the product to complete…")
+            return
+        if self.ledger.remaining_quantity(self.product_info) == 0:
+            self.retire()
+            return
+
+        self.attempt_count += 1
+        self.logger.info(f"Attempt #{self.attempt_count}…")
+        tracing.set_attribute("attempt", self.attempt_count)
+
+        if self.attempt_count % 10000 == 0:
+            self.init_chrome_webdriver()
+
+        self.response = None
+        try:
+            # Probe the product's stock cheaply, only starting the checkout if its state may have changed.
+            # A change stays pending until the product has been added to the basket, in case the attempt aborts first.
+            if not self.in_stock and not self.stock_changed:
+                if not self.probe():
+                    self.logger.debug("-> The product's stock state is unchanged.")
+                    return
+                self.stock_changed = True
+
+            # The basket is changing under another product's checkout, so it isn't worth checking until that ends.
+            owned_by_another = self.basket_coordinator.owned_by_another(self.product_info.pid)
+            if self.checkout_state is not CheckoutState.ADD_PRODUCT and owned_by_another:
+                self.logger.debug("-> Another product's checkout owns the basket; not resuming yet.")
                 return
-            self.logger.info("-> Created order for the basket.")
 
-            # Create a payment request for the basket.
-            response = API.create_payment_request(
-                session=self.session,
-                basket_id=self.basket_id,
-                logger=self.logger
-            )
-            if not response.ok:
-                self.logger.error(
-                    "-> Failed to create payment request for the basket"
-                    f" [{response.status_code}]."
+            # Start the attempt's deadline, which every request in the checkout must finish within.
+            self.deadline = Deadline(self.config.attempt_deadline)
+
+            # Add the required cookies to the current requests session.
+            self.session.cookies.clear()
+            add_dict_to_cookiejar(self.session.cookies, self.required_cookies)
+
+            # Resume the checkout from the first unfinished step, checking the last confirmed basket state.
+            tracing.set_attribute("checkout.started", True)
+            bandwidth.record_checkout_started()
+            if self.checkout_state is not CheckoutState.ADD_PRODUCT:
+                with tracing.span("checkout.resume"):
+                    self.checkout_state = self.resume_checkout_state()
+                self.logger.info(f"-> Resuming the checkout from state '{self.checkout_state.label}'.")
+
+            # Add the product to the basket.
+            if self.checkout_state is CheckoutState.ADD_PRODUCT and not self.run_checkout_state():
+                return
+
+            # Take ownership of the account's basket, unless another product's checkout already owns it.
+            # Whether the owner merges the product is only known once its payment marks the product as pending.
+            if not self.basket_coordinator.acquire_checkout(self.product_info):
+                self.awaiting_merge = True
+                self.logger.debug(
+                    "-> Another product's checkout owns the basket;"
+                    " waiting for it to merge the product."
                 )
                 return
-            self.logger.info("-> Created payment request for the basket.")
-
-            # Submit the payment requests for the basket.
-            for payment_request in response.json()["payload"]["paymentRequests"]:
-                if payment_request["status"] == "new":
-                    response = API.submit_payment(
-                        session=self.session,
-                        payment_info=self.payment_info,
-                        payment_url=payment_request["paymentMethodRequestData"]["payment_url"],
-                        webdriver=self.webdriver,
-                        notify=self.notify,
-                        dry_run=self.config.dry_run,
-                        logger=self.logger
-                    )
-                    self.logger.info("-> Submitted payment for the basket.")
-                    if response is None:
-                        self.logger.log(
-                            35,
-                            "-> SUCCESS?"
-                            " Please check for any 3D Secure authentication prompts from your payment method;"
-                            " waiting for 60 seconds…"
-                        )
-                        sleep(60)
+            self.awaiting_merge = False
+            try:
+                while self.checkout_state is not CheckoutState.COMPLETE:
+                    if not self.run_checkout_state():
                         return
-                    else:
-                        self.logger.error(
-                            "-> Failed to submit payment due to an invalid response from {response.url}"
-                            f" [{response.status_code}]."
-                        )
+                self.checkout_timer.log_summary(logger=self.logger)
+                tracing.set_attribute("checkout.completed", True)
+                bandwidth.record_checkout_completed()
+                self.reset_checkout()
+            finally:
+                self.basket_coordinator.release_checkout()
         except Timeout:
             failure_count = self.failure_counts.get("request_timeout", 0) + 1
             self.failure_counts["request_timeout"] = failure_count
@@ -464,20 +950,49 @@ class Scalper(Thread):
             self.logger.critical(
                 "-> Failed to decode JSON"
                 f" {failure_count} time{'' if failure_count == 1 else 's'}"
-                f" [{response.status_code}]."
-                f" Response from {response.url} has content: {response.content}."
+                f" [{self.response.status_code}]."
+                f" Response from {self.response.url} has content: {self.response.content}."
             )
             if failure_count >= 10:
                 self.clear_cache(clear_all_cookies=True)
             return
 
+    @contextmanager
+    def trace_attempt(self) -> Iterator[None]:
+        if self.tracer is None:
+            yield
+            return
+        with self.tracer.trace("attempt", {"product.pid": self.product_info.pid}) as root:
+            try:
+                yield
+            finally:
+                root.set_attribute("checkout.state", self.checkout_state.label)
+
+    @contextmanager
+    def meter_attempt(self) -> Iterator[None]:
+        if self.bandwidth_meter is None:
+            yield
+            return
+        with self.bandwidth_meter.attempt(self.product_info.pid):
+            yield
+
     # noinspection PyBroadException
     def run(self) -> None:
-        while True:
+        while not self.retired:
             try:
-                self.scalp()
+                if self.drop_window is not None and self.drop_window.due_for_preparation():
+                    self.prepare_for_drop()
+                elif self.preparation_requested:
+                    self.prepare()
+                with self.trace_attempt(), self.meter_attempt():
+                    if self.profile_attempts > 0 and self.profiler is not None:
+                        self.profiler.profile_attempt(self, self.scalp)
+                    else:
+                        self.scalp()
             except Scalper.AbortAttemptException:
                 self.logger.critical(f"Aborted attempt #{self.attempt_count}.")
+            except WebDriverHang as e:
+                self.logger.critical(f"Aborted attempt #{self.attempt_count}: {e}")
             except KeyboardInterrupt:
                 exit(0)
             except:
@@ -486,4 +1001,5 @@ class Scalper(Thread):
                 self.logger.critical(format_exc())
                 if failure_count >= 10:
                     self.clear_cache(clear_all_cookies=True)
-            sleep(1)
+            self.woken.wait(self.next_poll_interval())
+            self.woken.clear()
@@ -0,0 +1,110 @@
+import logging
+
+from logging import Logger
+from threading import Event, Thread
+from time import localtime, monotonic, strftime, time
+from traceback import format_exc
+from typing import Callable, List, Optional, Set
+
+from config import Config
+from journal import HOURS_PER_WEEK, RestockJournal, hour_of_week, restock_distribution, restock_times
+from prewarm import Prewarmer
+
+
+class PollScheduler(Thread):
+    def __init__(
+        self,
+        config: Config.Scheduler,
+        journal: RestockJournal,
+        threads: Callable[[], List[Thread]],
+        prewarmer: Optional[Prewarmer] = None,
+        logger: Logger = logging
+    ):
+        super().__init__(daemon=True)
+        self.config = config
+        self.journal = journal
+        self.threads = threads
+        self.prewarmer = prewarmer
+        self.logger = logger
+
+        self.intervals: Optional[List[float]] = None
+        self.hot_hours: Set[int] = set()
+        self.prepared_hours: Set[int] = set()
+        self.refreshed_at: Optional[float] = None
+        self.stopped = Event()
+
+    def active_threads(self) -> List[Thread]:
+        return [x for x in self.threads() if not getattr(x, "retired", False)]
+
+    def refresh(self) -> None:
+        self.refreshed_at = monotonic()
+        restocks, observed_hours = restock_times(self.journal.read())
+        restock_counts, observed_counts = restock_distribution(
+            restocks,
+            observed_hours,
+            since=time() - self.config.history_days * 86400
+        )
+        weights = [
+            (restock_count + self.config.smoothing) / (observed_count + 1)
+            for restock_count, observed_count in zip(restock_counts, observed_counts)
+        ]
+        if sum(weights) == 0:
+            # With no restocks and no smoothing, there's nothing to prefer any hour by, so split the budget evenly.
+            weights = [1.0] * HOURS_PER_WEEK
+        mean_weight = sum(weights) / HOURS_PER_WEEK
+        thread_count = max(len(self.active_threads()), 1)
+        # Split a week's worth of the hourly request budget between the hours of the week by restock rate.
+        weekly_budget = self.config.request_budget * HOURS_PER_WEEK
+        # Without smoothing, an hour with no restocks isn't polled at all.
+        self.intervals = [
+            max(thread_count * 3600 / (weekly_budget * weight / sum(weights)), self.config.min_interval)
+            if weight > 0 else float("inf")
+            for weight in weights
+        ]
+        self.hot_hours = {hour for hour, weight in enumerate(weights) if weight > mean_weight * 1.5}
+        self.logger.info(
+            f"-> Rebuilt the poll schedule from {sum(restock_counts)} restocks"
+            f" over {sum(observed_counts)} observed hours;"
+            f" poll intervals range from {min(self.intervals):.2f}s to {max(self.intervals):.2f}s"
+            f" with {len(self.hot_hours)} high-probability hours of the week."
+        )
+
+    def poll_interval(self) -> Optional[float]:
+        if self.intervals is None:
+            return None
+        # Never wait past the end of the hour, as the next hour may be polled much more often.
+        now = time()
+        return min(self.intervals[hour_of_week(now)], 3600 - now % 3600)
+
+    def prepare(self, hour: int) -> None:
+        self.logger.info(
+            "-> Preparing for a high-probability restock window"
+            f" at {strftime('%a %H:00', localtime(hour * 3600))}…"
+        )
+        if self.prewarmer is not None:
+            self.prewarmer.warm()
+        for thread in self.active_threads():
+            thread.request_preparation()
+
+    def check_windows(self) -> None:
+        now = time()
+        for hour in {int(now // 3600), int((now + self.config.lead_time) // 3600)}:
+            if hour_of_week(hour * 3600) in self.hot_hours and hour not in self.prepared_hours:
+                self.prepared_hours.add(hour)
+                self.prepare(hour)
+        self.prepared_hours = {x for x in self.prepared_hours if x >= int(now // 3600)}
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    # noinspection PyBroadException
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                if self.refreshed_at is None or monotonic() - self.refreshed_at >= self.config.refresh_interval:
+                    self.refresh()
+                self.check_windows()
+            except:
+                self.logger.error("-> Error while scheduling polls.")
+                self.logger.error(format_exc())
+            self.stopped.wait(min(60, self.config.lead_time / 2))
@@ -0,0 +1,192 @@
+import logging
+import tracemalloc
+
+from argparse import ArgumentParser
+from os import getpid, path
+from tempfile import mkdtemp
+from time import monotonic, sleep
+from typing import List, Optional
+
+import coloredlogs
+
+from basket import BasketCoordinator
+from config import Config
+from ledger import PurchaseLedger
+from scalper import Scalper
+from standin import StandInAdapter, StandInBackend, StandInWebDriver
+from watchdog import child_pids
+
+
+class SoakScalper(Scalper):
+    @property
+    def base_required_cookies_wait(self) -> float:
+        # The stand-in browser has no scripts to wait for, so bootstrapping its cookies shouldn't stall the loop.
+        return Scalper.base_required_cookies_wait if self.config.chromedriver_location else 0
+
+    def init_chrome_webdriver(self) -> None:
+        if self.config.chromedriver_location:
+            super().init_chrome_webdriver()
+            return
+        with self.webdriver_lock:
+            self.chrome_webdriver = StandInWebDriver()
+
+
+def rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status", "r") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def slope(points: List[List[float]]) -> float:
+    if len(points) < 2:
+        return 0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance == 0:
+        return 0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+class MemoryMonitor:
+    def __init__(
+        self,
+        budget_mb: float,
+        max_slope_mb_per_hour: float,
+        warmup: float,
+        top: int,
+        logger: logging.Logger
+    ):
+        self.budget_mb = budget_mb
+        self.max_slope_mb_per_hour = max_slope_mb_per_hour
+        self.warmup = warmup
+        self.top = top
+        self.logger = logger
+
+        self.started_at = monotonic()
+        self.samples: List[List[float]] = []
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.latest: Optional[tracemalloc.Snapshot] = None
+
+    def sample(self) -> None:
+        elapsed = monotonic() - self.started_at
+        python_rss = rss_bytes(getpid())
+        children_rss = sum(rss_bytes(x) for x in child_pids(getpid()))
+        traced, _ = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")
+        ])
+        if elapsed >= self.warmup and self.baseline is None:
+            self.baseline = snapshot
+        self.latest = snapshot
+        self.samples.append([elapsed, python_rss, children_rss, traced])
+        self.logger.info(
+            f"-> {elapsed:.0f}s: Python RSS {python_rss / 2 ** 20:.1f} MiB,"
+            f" children RSS {children_rss / 2 ** 20:.1f} MiB,"
+            f" traced {traced / 2 ** 20:.1f} MiB."
+        )
+
+    def report(self) -> bool:
+        samples = [x for x in self.samples if x[0] >= self.warmup]
+        total_rss = [[x[0], (x[1] + x[2]) / 2 ** 20] for x in samples]
+        total_slope = slope(total_rss) * 3600
+        python_slope = slope([[x[0], x[1] / 2 ** 20] for x in samples]) * 3600
+        children_slope = slope([[x[0], x[2] / 2 ** 20] for x in samples]) * 3600
+        peak = max((x[1] for x in total_rss), default=0)
+        self.logger.info(
+            f"-> Peak RSS {peak:.1f} MiB (budget {self.budget_mb:.1f} MiB);"
+            f" slope {total_slope:.2f} MiB/hour (Python {python_slope:.2f}, children {children_slope:.2f};"
+            f" limit {self.max_slope_mb_per_hour:.2f})."
+        )
+        if self.baseline is not None and self.latest is not None:
+            growth = [x for x in self.latest.compare_to(self.baseline, "lineno") if x.size_diff > 0]
+            self.logger.info(f"-> Top {self.top} growing allocation sites since the warmup:")
+            for statistic in growth[:self.top]:
+                self.logger.info(f"->   {statistic}")
+        failed = False
+        if peak > self.budget_mb:
+            self.logger.error("-> FAILED: memory went over the budget.")
+            failed = True
+        if len(total_rss) >= 3 and total_slope > self.max_slope_mb_per_hour:
+            self.logger.error("-> FAILED: memory grew faster than the slope limit.")
+            failed = True
+        return not failed
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Run the scalp loop at accelerated speed against a local stand-in.")
+    parser.add_argument("--duration", type=float, default=600, help="Seconds to soak for.")
+    parser.add_argument("--interval", type=float, default=10, help="Seconds between memory samples.")
+    parser.add_argument("--warmup", type=float, default=30, help="Seconds to ignore before measuring growth.")
+    parser.add_argument("--products", type=int, default=3, help="Number of stand-in products to scalp.")
+    parser.add_argument("--poll-interval", type=float, default=0.01, help="Seconds between attempts.")
+    parser.add_argument("--budget-mb", type=float, default=512, help="Maximum RSS (including children) in MiB.")
+    parser.add_argument("--max-slope-mb-per-hour", type=float, default=20, help="Maximum RSS growth rate.")
+    parser.add_argument("--top", type=int, default=10, help="Number of growing allocation sites to report.")
+    parser.add_argument("--chromedriver", default="", help="Use a real Chrome webdriver from this location.")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("Soak")
+    coloredlogs.install(fmt="[%(name)s] : [%(levelname)-8s] : %(message)s", level=logging.INFO, logger=logger)
+
+    tracemalloc.start(25)
+    backend = StandInBackend()
+    Scalper.session.mount("https://", StandInAdapter(backend))
+    product_infos = [Config.ProductInfo(f"Soak Product {i}", str(10000000 + i), 1) for i in range(args.products)]
+    scalper_config = Config.Scalper(
+        chromedriver_location=args.chromedriver,
+        delivery_sort_method="price_low_high",
+        dry_run=True,
+        ssl_verify=True,
+        completion_timeout=0.1,
+        ledger_path=path.join(mkdtemp(), "purchases.jsonl")
+    )
+    basket_coordinator = BasketCoordinator(product_infos, logger=logger)
+    ledger = PurchaseLedger(scalper_config.ledger_path)
+    scalpers = []
+    for product_info in product_infos:
+        scalper = SoakScalper(
+            config=scalper_config,
+            ifttt_config=Config.IFTTT(key="", webhook_event_names=[]),
+            payment_info=Config.PaymentInfo("4444333322221111", "Soak Test", "01", "30", "123"),
+            product_info=product_info,
+            user_info=Config.UserInfo("soak@example.com", "", "AB1 2CD", 0, 0),
+            max_product_name_length=max(len(x.name) for x in product_infos),
+            basket_coordinator=basket_coordinator,
+            ledger=ledger
+        )
+        scalper.poll_interval = args.poll_interval
+        scalper.logger.setLevel(logging.WARNING)
+        scalper.daemon = True
+        scalpers.append(scalper)
+    for scalper in scalpers:
+        scalper.start()
+
+    monitor = MemoryMonitor(
+        budget_mb=args.budget_mb,
+        max_slope_mb_per_hour=args.max_slope_mb_per_hour,
+        warmup=args.warmup,
+        top=args.top,
+        logger=logger
+    )
+    deadline = monotonic() + args.duration
+    while monotonic() < deadline:
+        monitor.sample()
+        sleep(min(args.interval, max(deadline - monotonic(), 0)))
+    monitor.sample()
+    logger.info(
+        f"-> Made {sum(x.attempt_count for x in scalpers)} attempts"
+        f" ({backend.request_count} requests, {backend.order_count} orders)"
+        f" in {args.duration:.0f}s."
+    )
+    return 0 if monitor.report() else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,312 @@
+import gzip
+import json
+import re
+import zlib
+
+from email.utils import formatdate
+from hashlib import blake2b
+from http.client import HTTPMessage
+from io import BytesIO
+from requests import PreparedRequest, Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from threading import Lock
+from time import monotonic, time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from urllib3 import HTTPResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class StandInBackend:
+    def __init__(
+        self,
+        stock_period: float = 5,
+        in_stock_seconds: float = 1,
+        clock_offset: float = 0,
+        page_size: int = 0
+    ):
+        self.stock_period = stock_period
+        self.in_stock_seconds = in_stock_seconds
+        self.clock_offset = clock_offset
+        self.page_size = page_size
+        self.filler = b"".join(
+            f'<div class="x{blake2b(str(i).encode(), digest_size=8).hexdigest()}"></div>\n'.encode()
+            for i in range(page_size // 32 + 1)
+        )
+
+        self.started_at = monotonic()
+        self.lock = Lock()
+        self.products: Dict[str, Dict[str, Any]] = {}
+        self.consignments: List[Dict[str, Any]] = []
+        self.payment_requests: List[Dict[str, Any]] = []
+        self.order_count = 0
+        self.ordered_product_count = 0
+        self.request_count = 0
+
+        self.routes: List[Tuple[str, re.Pattern, Callable]] = [
+            ("GET", re.compile(r"www\.currys\.co\.uk/gbuk/s/authentication\.html"), self.get_authentication),
+            ("POST", re.compile(r"www\.currys\.co\.uk/gbuk/s/authentication\.html"), self.post_authentication),
+            ("GET", re.compile(r"www\.currys\.co\.uk/api/user/token"), self.get_token),
+            ("POST", re.compile(r"www\.currys\.co\.uk/api/cart/addProduct"), self.add_product),
+            ("GET", re.compile(r"api\.currys\.co\.uk/store/api/products/(?P<pid>[^/]+)$"), self.get_product),
+            ("GET", re.compile(r"api\.currys\.co\.uk/store/api/baskets/[^/]+$"), self.get_basket),
+            ("DELETE", re.compile(r"/baskets/[^/]+/products/(?P<pid>[^/]+)$"), self.delete_product),
+            ("PUT", re.compile(r"/baskets/[^/]+/products/(?P<pid>[^/]+)/quantity$"), self.set_quantity),
+            ("PUT", re.compile(r"/baskets/[^/]+/products/(?P<pid>[^/]+)/fulfilmentChannel$"), self.set_fulfilment),
+            ("PUT", re.compile(r"/baskets/[^/]+/deliveryLocation$"), self.set_delivery_location),
+            ("PUT", re.compile(r"/baskets/[^/]+/consignments/[^/]+/deliverySlot$"), self.set_delivery_slot),
+            ("POST", re.compile(r"/baskets/[^/]+/offerRedemptions$"), self.apply_offer_code),
+            ("PUT", re.compile(r"/baskets/[^/]+/payments/[^/]+$"), self.get_basket),
+            ("POST", re.compile(r"/baskets/[^/]+/orders$"), self.create_order),
+            ("POST", re.compile(r"/baskets/[^/]+/payments$"), self.create_payment_request),
+            ("GET", re.compile(r"worldpay\.com/app/hpp/integration/"), self.get_payment_page),
+            ("POST", re.compile(r"worldpay\.com/app/hpp/17-1/rest/cardtypes$"), self.get_card_type),
+            ("POST", re.compile(r"worldpay\.com/app/hpp/17-1/payment/multicard/process$"), self.process_payment),
+        ]
+
+    @property
+    def in_stock(self) -> bool:
+        return (monotonic() - self.started_at) % self.stock_period < self.in_stock_seconds
+
+    @property
+    def stock_version(self) -> int:
+        return int((monotonic() - self.started_at) // self.stock_period) * 2 + (not self.in_stock)
+
+    def basket(self, **extra) -> Tuple[int, Dict[str, str], bytes]:
+        payload = {
+            "products": list(self.products.values()),
+            "consignments": self.consignments,
+            "paymentRequests": self.payment_requests
+        } | extra
+        return 200, {"Content-Type": "application/json"}, json.dumps({"payload": payload}).encode()
+
+    def page(self, markup: bytes) -> bytes:
+        # Pad the page after its markup, as a real page's scripts and footer would be.
+        return markup + self.filler[:max(self.page_size - len(markup), 0)]
+
+    def handle(self, request: PreparedRequest) -> Tuple[int, Dict[str, str], bytes]:
+        url = urlsplit(request.url)
+        target = f"{url.hostname}{url.path}"
+        with self.lock:
+            self.request_count += 1
+            if request.method == "HEAD":
+                return 200, {}, b""
+            for method, pattern, handler in self.routes:
+                matches = pattern.search(target)
+                if method == request.method and matches is not None:
+                    return handler(request, **matches.groupdict())
+        return 404, {}, b"Not Found"
+
+    # noinspection PyUnusedLocal
+    def get_authentication(self, request: PreparedRequest) -> Tuple[int, Dict[str, str], bytes]:
+        return 200, {"Content-Type": "text/html"}, self.page(
+            b'<form data-login-token-name="token" data-login-token-value="stand-in"></form>'
+        )
+
+    # noinspection PyUnusedLocal
+    def post_authentication(self, request: PreparedRequest) -> Tuple[int, Dict[str, str], bytes]:
+        return 302, {"Location": "/", "Set-Cookie": "store-currys=stand-in; Path=/"}, b""
+
+    # noinspection PyUnusedLocal
+    def get_token(self, request: PreparedRequest) -> Tuple[int, Dict[str, str], bytes]:
+        return 200, {"Content-Type": "application/json"}, b'{"bid": "stand-in"}'
+
+    def get_product(self, request: PreparedRequest, pid: str) -> Tuple[int, Dict[str, str], bytes]:
+        etag = f'"{self.stock_version}"'
+        if request.headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        body = json.dumps({"id": pid, "inStock": self.in_stock}).encode()
+        return 200, {"Content-Type": "application/json", "ETag": etag}, body
+
+    def add_product(self, request: PreparedRequest) -> Tuple[int, Dict[str, str], bytes]:
+        if not self.in_stock:
+            return 422, {"Content-Type": "application/json"}, b'{"error": "out of stock"}'
+        pid = json.loads(request.body)["fupid"]
+        self.products.setdefault(pid, {
+            "id": pid,
+            "title": f"Stand-in product {pid}",
+            "price": {"amountWithVat": 64999, "currency": "GBP"},
+            "quantity": 1,
+            "fulfilmentChannel": "collection"
+        })
+        return 200, {"Content-Type": "application/json"}, b'{"success": true}'
+
+    # noinspection PyUnusedLocal
+    def get_basket(self, request: PreparedRequest) -> Tuple[int, Dict[str, str], bytes]:
+        return self.basket()
+
+    # noinspection PyUnusedLocal
+    def delete_product(self, request: PreparedRequest, pid: str) -> Tuple[int, Dict[str, str], bytes]:
+        self.products.pop(pid, None)
+        return self.basket()
+
+    # noinspection PyUnusedLocal
+    def set_quantity(self, request: PreparedRequest, pid: str) -> Tuple[int, Dict[str, str], bytes]:
+        if pid not in self.products:
+            return 404, {}, b"Not Found"
+        return self.basket()
+
+    # noinspection PyUnusedLocal
+    def set_fulfilment(self, request: PreparedRequest, pid: str) -> Tuple[int, Dict[str, str], bytes]:
+        if pid in self.products:
+            self.products[pid]["fulfilmentChannel"] = "home-delivery"
+        return self.basket()
+
+    # noinspection PyUnusedLocal
+    def set_delivery_location(self, request: PreparedRequest) -> Tuple[int, Dict[str, str], bytes]:
+        self.consignments = [{
+            "id": {"type": "standard"},
+            "isReadyForDelivery": False,
+            "deliverySlot": None,
+            "availableDeliverySlots": [
+                {
+                    "provider": "standard" if i == 0 else "premium",
+                    "price": {"amountWithVat": i * 500, "vatRate": 20, "currency": "GBP"},
+                    "date": f"2021-01-{i + 10:02d}",
+                    "timeSlot": "07:00-19:00"
+                }
+                for i in range(20)
+            ]
+        }]
+        return self.basket()
+
+    # noinspection PyUnusedLocal
+    def set_delivery_slot(self, request: PreparedRequest) -> Tuple[int, Dict[str, str], bytes]:
+        for consignment in self.consignments:
+            consignment["isReadyForDelivery"] = True
+            consignment["deliverySlot"] = consignment["availableDeliverySlots"][0]
+        return self.basket()
+
+    # noinspection PyUnusedLocal
+    def apply_offer_code(self, request: PreparedRequest) -> Tuple[int, Dict[str, str], bytes]:
+        return self.basket(totalDiscountAmount={"amountWithVat": 0, "currency": "GBP"})
+
+    # noinspection PyUnusedLocal
+    def create_order(self, request: PreparedRequest) -> Tuple[int, Dict[str, str], bytes]:
+        self.order_count += 1
+        self.ordered_product_count += len(self.products)
+        return self.basket()
+
+    # noinspection PyUnusedLocal
+    def create_payment_request(self, request: PreparedRequest) -> Tuple[int, Dict[str, str], bytes]:
+        self.payment_requests = [{
+            "id": f"payment-{self.order_count}",
+            "status": "new",
+            "paymentMethodRequestData": {
+                "payment_url": f"https://payments.worldpay.com/app/hpp/integration/{self.order_count}"
+            }
+        }]
+        return self.basket()
+
+    # noinspection PyUnusedLocal
+    def get_payment_page(self, request: PreparedRequest) -> Tuple[int, Dict[str, str], bytes]:
+        return 200, {"Content-Type": "text/html", "Set-Cookie": "JSESSIONID=stand-in; Path=/"}, self.page(
+            b'<form action="/app/hpp/17-1/payment/multicard/process">'
+            b'<input name="_csrf" value="stand-in"></form>'
+        )
+
+    # noinspection PyUnusedLocal
+    def get_card_type(self, request: PreparedRequest) -> Tuple[int, Dict[str, str], bytes]:
+        return 200, {"Content-Type": "application/json"}, b'{"cardType": {"type": "VISA"}}'
+
+    # noinspection PyUnusedLocal
+    def process_payment(self, request: PreparedRequest) -> Tuple[int, Dict[str, str], bytes]:
+        self.payment_requests = []
+        self.products = {}
+        return 200, {"Content-Type": "text/html"}, (
+            b'<iframe src="https://payments.worldpay.com/app/hpp/17-1/payment/auth/stand-in/iframe"></iframe>'
+        )
+
+
+class StandInAdapter(HTTPAdapter):
+    def __init__(self, backend: StandInBackend):
+        super().__init__()
+        self.backend = backend
+
+    def send(self, request: PreparedRequest, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        status, headers, body = self.backend.handle(request)
+        headers = {"Date": formatdate(time() + self.backend.clock_offset, usegmt=True)} | headers
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+        if encoding is not None and len(body) > 0:
+            headers["Content-Encoding"] = encoding
+            body = encode_body(body, encoding)
+        return build_response(self, request, status, headers, body)
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {x.split(";")[0].strip() for x in accept_encoding.split(",")}
+    for encoding in ("br", "gzip", "deflate"):
+        if encoding in accepted and (encoding != "br" or brotli is not None):
+            return encoding
+    return None
+
+
+def encode_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body)
+    elif encoding == "gzip":
+        return gzip.compress(body)
+    return zlib.compress(body)
+
+
+class StandInOriginalResponse:
+    def __init__(self, msg: HTTPMessage):
+        self.msg = msg
+
+    def isclosed(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+def build_response(
+    adapter: BaseAdapter,
+    request: PreparedRequest,
+    status: int,
+    headers: Dict[str, str],
+    body: bytes,
+    body_stream: Optional[Any] = None
+) -> Response:
+    message = HTTPMessage()
+    for name, value in headers.items():
+        message[name] = value
+    headers = {"Content-Length": str(len(body))} | headers
+    raw = HTTPResponse(
+        body=body_stream if body_stream is not None else BytesIO(body),
+        headers=headers,
+        status=status,
+        preload_content=False,
+        decode_content=False,
+        original_response=StandInOriginalResponse(message)
+    )
+    return HTTPAdapter.build_response(adapter, request, raw)
+
+
+class StandInWebDriver:
+    def __init__(self):
+        self.current_url = "about:blank"
+        self.cookies: Dict[str, str] = {}
+
+    def get(self, url: str) -> None:
+        self.current_url = url
+
+    def delete_all_cookies(self) -> None:
+        self.cookies = {}
+
+    def delete_cookie(self, name: str) -> None:
+        self.cookies.pop(name, None)
+
+    def add_cookie(self, cookie: Dict[str, str]) -> None:
+        self.cookies[cookie["name"]] = cookie["value"]
+
+    def get_cookies(self) -> List[Dict[str, str]]:
+        return [{"name": name, "value": value} for name, value in self.cookies.items()]
+
+    def quit(self) -> None:
+        pass
@@ -0,0 +1,45 @@
+import logging
+
+from contextlib import contextmanager
+from logging import Logger
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Iterator
+
+
+class StartupTimer:
+    def __init__(
+        self,
+        expected_count: int = 1,
+        logger: Logger = logging
+    ):
+        self.expected_count = expected_count
+        self.logger = logger
+
+        self.started_at = perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.milestones: Dict[str, int] = {}
+        self.lock = Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started_at = perf_counter()
+        try:
+            yield
+        finally:
+            duration = perf_counter() - started_at
+            self.phases[name] = duration
+            self.logger.info(f"-> Startup phase '{name}' took {duration:.3f}s.")
+
+    def milestone(self, name: str) -> None:
+        with self.lock:
+            count = self.milestones.get(name, 0) + 1
+            self.milestones[name] = count
+        elapsed = perf_counter() - self.started_at
+        if count == 1:
+            self.logger.info(f"-> Startup milestone '{name}' first reached after {elapsed:.3f}s.")
+        if count == self.expected_count:
+            self.logger.info(
+                f"-> Startup milestone '{name}' reached by all {self.expected_count}"
+                f" scalpers after {elapsed:.3f}s."
+            )
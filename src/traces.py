@@ -0,0 +1,145 @@
+import json
+
+from argparse import ArgumentParser
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+
+from config import Config
+from deadline import percentile
+from journal import journal_file_paths
+
+
+class TraceSpan:
+    def __init__(self, span: Dict[str, Any]):
+        self.span_id: str = span["spanId"]
+        self.parent_span_id: Optional[str] = span.get("parentSpanId")
+        self.name: str = span["name"]
+        self.start: float = int(span["startTimeUnixNano"]) / 1e9
+        self.end: float = int(span["endTimeUnixNano"]) / 1e9
+        self.attributes = {x["key"]: attribute_value(x["value"]) for x in span.get("attributes", [])}
+        self.failed = span.get("status", {}).get("code") == 2
+        self.children: List["TraceSpan"] = []
+
+    @property
+    def label(self) -> str:
+        # HTTP spans are only distinguishable by their endpoint.
+        if self.name.startswith("HTTP ") and "http.url" in self.attributes:
+            return f"{self.name} {urlparse(self.attributes['http.url']).path}"
+        return self.name
+
+
+def attribute_value(value: Dict[str, Any]) -> Any:
+    if "intValue" in value:
+        return int(value["intValue"])
+    return next(iter(value.values()), None)
+
+
+def read_traces(file_path: str, backup_count: int) -> Iterator[TraceSpan]:
+    for trace_file_path in journal_file_paths(file_path, backup_count):
+        with open(trace_file_path, "r") as file:
+            for line in file:
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    continue
+                spans = [
+                    TraceSpan(x)
+                    for resource_spans in request.get("resourceSpans", [])
+                    for scope_spans in resource_spans.get("scopeSpans", [])
+                    for x in scope_spans.get("spans", [])
+                ]
+                spans_by_id = {x.span_id: x for x in spans}
+                root = None
+                for span in spans:
+                    if span.parent_span_id in spans_by_id:
+                        spans_by_id[span.parent_span_id].children.append(span)
+                    elif span.parent_span_id is None:
+                        root = span
+                if root is not None:
+                    yield root
+
+
+def critical_path(span: TraceSpan, end: float, contributions: Dict[str, float]) -> None:
+    # Walk back from the end of the span, following whichever child was still running at the time; whatever the
+    # children don't cover is the span's own time.
+    cursor = end
+    for child in sorted(span.children, key=lambda x: x.end, reverse=True):
+        if child.start >= cursor:
+            continue
+        child_end = min(child.end, cursor)
+        contributions[span.label] = contributions.get(span.label, 0) + cursor - child_end
+        critical_path(child, child_end, contributions)
+        cursor = child.start
+    contributions[span.label] = contributions.get(span.label, 0) + max(cursor - span.start, 0)
+
+
+def step_times(root: TraceSpan) -> Dict[str, float]:
+    contributions: Dict[str, float] = {}
+    critical_path(root, root.end, contributions)
+    return contributions
+
+
+def time_to_payment(root: TraceSpan) -> Optional[float]:
+    payment_ends = [x.end for x in root.children if x.name == "checkout.submit_payment" and not x.failed]
+    return max(payment_ends) - root.start if payment_ends else None
+
+
+def print_ranking(title: str, roots: List[TraceSpan], top: int) -> None:
+    if len(roots) == 0:
+        return
+    totals: Dict[str, List[float]] = {}
+    for root in roots:
+        for label, duration in step_times(root).items():
+            totals.setdefault(label, []).append(duration)
+    total = sum(x.end - x.start for x in roots)
+    durations = [x.end - x.start for x in roots]
+    print(
+        f"\n{title}: {len(roots)} traces, p50 {percentile(durations, 50):.3f}s,"
+        f" p95 {percentile(durations, 95):.3f}s, max {max(durations):.3f}s."
+    )
+    print(f"{'critical path':>13}  {'share':>6}  {'mean':>8}  {'count':>5}  span")
+    for label, times in sorted(totals.items(), key=lambda x: sum(x[1]), reverse=True)[:top]:
+        print(
+            f"{sum(times):12.3f}s  {sum(times) / total * 100:5.1f}%  {sum(times) / len(roots):7.3f}s"
+            f"  {len(times):5d}  {label}"
+        )
+
+
+def main() -> int:
+    tracing_config = Config.Tracing()
+    parser = ArgumentParser(description="Rank checkout steps by their contribution to the critical path.")
+    parser.add_argument("--traces", default=tracing_config.path, help="Path of the trace file.")
+    parser.add_argument("--backup-count", type=int, default=tracing_config.backup_count, help="Rotated files to read.")
+    parser.add_argument("--pid", action="append", help="Only include this product (may be repeated).")
+    parser.add_argument("--top", type=int, default=15, help="Number of spans to list.")
+    args = parser.parse_args()
+
+    roots = [
+        x for x in read_traces(args.traces, args.backup_count)
+        if not args.pid or x.attributes.get("product.pid") in args.pid
+    ]
+    completed = [x for x in roots if x.attributes.get("checkout.completed", False)]
+    failed = [x for x in roots if x.attributes.get("checkout.started", False) and x not in completed]
+    print(f"{len(roots)} traces: {len(completed)} completed checkouts, {len(failed)} failed checkouts.")
+
+    payment_times = [x for x in map(time_to_payment, completed) if x is not None]
+    if payment_times:
+        print(
+            f"Time to payment: p50 {percentile(payment_times, 50):.3f}s, p95 {percentile(payment_times, 95):.3f}s,"
+            f" min {min(payment_times):.3f}s, max {max(payment_times):.3f}s."
+        )
+    print_ranking("Completed checkouts", completed, args.top)
+    print_ranking("Failed checkouts", failed, args.top)
+    failed_states: Dict[str, int] = {}
+    for root in failed:
+        state = root.attributes.get("checkout.state", "unknown")
+        failed_states[state] = failed_states.get(state, 0) + 1
+    if failed_states:
+        print("Failed at: " + ", ".join(f"{state} ×{count}" for state, count in sorted(
+            failed_states.items(), key=lambda x: x[1], reverse=True
+        )) + ".")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from logging import Logger
+from requests import Response
+from threading import Lock
+from time import time_ns
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from config import Config
+from journal import RotatingFile
+
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+KIND_INTERNAL = 1
+KIND_CLIENT = 3
+
+
+class Span:
+    def __init__(
+        self,
+        trace: "Trace",
+        name: str,
+        parent: Optional["Span"] = None,
+        kind: int = KIND_INTERNAL,
+        attributes: Optional[Dict[str, Any]] = None,
+        start_time: Optional[int] = None
+    ):
+        self.trace = trace
+        self.name = name
+        self.parent = parent
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.span_id = os.urandom(8).hex()
+        self.start_time = start_time or time_ns()
+        self.end_time: Optional[int] = None
+        self.status = STATUS_UNSET
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, message: str) -> None:
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def end(self, end_time: Optional[int] = None) -> None:
+        self.end_time = end_time or time_ns()
+        self.trace.add(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_time),
+            "endTimeUnixNano": str(self.end_time),
+            "attributes": [{"key": key, "value": otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": self.status} | ({"message": self.status_message} if self.status_message else {})
+        }
+        if self.parent is not None:
+            span["parentSpanId"] = self.parent.span_id
+        return span
+
+
+class Trace:
+    def __init__(self, tracer: "Tracer"):
+        self.tracer = tracer
+        self.trace_id = os.urandom(16).hex()
+        self.lock = Lock()
+        self.spans: List[Span] = []
+
+    def add(self, span: Span) -> None:
+        with self.lock:
+            self.spans.append(span)
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    elif isinstance(value, int):
+        return {"intValue": str(value)}
+    elif isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def set_attribute(key: str, value: Any) -> None:
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+@contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None) -> Iterator[Optional[Span]]:
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent=parent, kind=kind, attributes=attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.set_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def traced(function: Callable) -> Callable:
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with span(f"API.{function.__name__}") as api_span:
+            result = function(*args, **kwargs)
+            if api_span is not None and isinstance(result, Response):
+                api_span.set_attribute("http.status_code", result.status_code)
+                if not result.ok:
+                    api_span.set_error(f"HTTP {result.status_code}")
+            return result
+
+    return wrapper
+
+
+def request_size(response: Response) -> int:
+    request = response.request
+    body = request.body or b""
+    headers_size = sum(len(name) + len(value) + 4 for name, value in request.headers.items())
+    return len(request.method) + len(request.path_url) + 11 + headers_size + len(body)
+
+
+def record_request(response: Response, *args, **kwargs) -> None:
+    parent = _current_span.get()
+    if parent is None:
+        return
+    end_time = time_ns()
+    request = response.request
+    attributes = {
+        "http.method": request.method,
+        "http.url": request.url.split("?")[0],
+        "http.status_code": response.status_code,
+        "http.request.size": request_size(response),
+        "http.redirect": response.is_redirect
+    }
+    if "Content-Length" in response.headers:
+        attributes["http.response.body.size"] = int(response.headers["Content-Length"])
+    connection = getattr(response.raw, "_connection", None)
+    if connection is not None:
+        # Mark the connection, so that the next request to use it can tell that it was reused.
+        attributes["http.connection.reused"] = getattr(connection, "traced_request_count", 0) > 0
+        connection.traced_request_count = getattr(connection, "traced_request_count", 0) + 1
+    retries = getattr(response.raw, "retries", None)
+    if retries is not None:
+        attributes["http.retry_count"] = len(retries.history)
+    http_span = Span(
+        parent.trace,
+        f"HTTP {request.method}",
+        parent=parent,
+        kind=KIND_CLIENT,
+        attributes=attributes,
+        start_time=end_time - int(response.elapsed.total_seconds() * 1e9)
+    )
+    if response.status_code >= 400:
+        http_span.set_error(f"HTTP {response.status_code}")
+    http_span.end(end_time)
+
+
+class Tracer:
+    def __init__(
+        self,
+        config: Config.Tracing,
+        logger: Logger = logging
+    ):
+        self.config = config
+        self.logger = logger
+
+        self.file = RotatingFile(config.path, config.max_bytes, config.backup_count)
+        self.trace_count = 0
+        self.export_count = 0
+
+    @contextmanager
+    def trace(self, name: str, attributes: Optional[Dict[str, Any]] = None) -> Iterator[Span]:
+        trace = Trace(self)
+        root = Span(trace, name, attributes=attributes)
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            root.end()
+            self.trace_count += 1
+            if not self.config.checkouts_only or root.attributes.get("checkout.started", False):
+                self.export(trace)
+
+    def export(self, trace: Trace) -> None:
+        with trace.lock:
+            spans = [x.to_otlp() for x in trace.spans]
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": otlp_value(self.config.service_name)}
+                ]},
+                "scopeSpans": [{"scope": {"name": "scalper"}, "spans": spans}]
+            }]
+        }
+        try:
+            self.file.write(json.dumps(request, separators=(",", ":")) + "\n")
+        except OSError as e:
+            self.logger.warning(f"-> Failed to export a trace: {e}.")
+            return
+        self.export_count += 1
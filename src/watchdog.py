@@ -0,0 +1,133 @@
+import logging
+import os
+import signal
+
+from collections import deque
+from glob import glob
+from logging import Logger
+from threading import Lock, Thread
+from typing import Any, Callable, Deque, Dict, List
+
+import tracing
+
+from config import Config
+from deadline import percentile
+
+
+class WebDriverHang(Exception):
+    pass
+
+
+def child_pids(pid: int) -> List[int]:
+    pids = []
+    for children_path in glob(f"/proc/{pid}/task/*/children"):
+        try:
+            with open(children_path, "r") as file:
+                pids.extend(int(x) for x in file.read().split())
+        except OSError:
+            continue
+    return pids + [x for child_pid in pids for x in child_pids(child_pid)]
+
+
+def kill_webdriver(webdriver: Any, logger: Logger = logging) -> None:
+    process = getattr(getattr(webdriver, "service", None), "process", None)
+    if process is None:
+        return
+    # Kill Chrome before chromedriver, as its processes are only reachable through chromedriver's.
+    pids = child_pids(process.pid)
+    for pid in reversed(pids):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+    process.kill()
+    logger.debug(f"-> Killed chromedriver ({process.pid}) and {len(pids)} of its child processes.")
+
+
+class WebDriverWatchdog:
+    def __init__(
+        self,
+        config: Config.Watchdog,
+        logger: Logger = logging
+    ):
+        self.config = config
+        self.logger = logger
+
+        self.lock = Lock()
+        self.hang_counts: Dict[str, int] = {}
+        self.recovery_times: Deque[float] = deque(maxlen=100)
+
+    def timeout(self, operation: str) -> float:
+        return self.config.timeouts.get(operation, self.config.default_timeout)
+
+    def call(self, operation: str, function: Callable[[], Any], on_hang: Callable[[], None]) -> Any:
+        with tracing.span(f"WebDriver.{operation}") as span:
+            if span is not None:
+                span.set_attribute("webdriver.timeout", self.timeout(operation))
+            return self.guarded_call(operation, function, on_hang)
+
+    def guarded_call(self, operation: str, function: Callable[[], Any], on_hang: Callable[[], None]) -> Any:
+        timeout = self.timeout(operation)
+        result: Dict[str, Any] = {}
+
+        # noinspection PyBroadException
+        def target() -> None:
+            try:
+                result["value"] = function()
+            except BaseException as e:
+                result["error"] = e
+
+        # A daemon thread rather than an executor, so that a call which never returns can't block the bot's exit.
+        thread = Thread(target=target, name=f"WebDriver {operation}", daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            with self.lock:
+                self.hang_counts[operation] = self.hang_counts.get(operation, 0) + 1
+            self.logger.error(f"-> The webdriver hung on '{operation}' for {timeout:g}s; recycling the browser…")
+            on_hang()
+            raise WebDriverHang(f"The webdriver hung on '{operation}' for {timeout:g}s.")
+        if "error" in result:
+            raise result["error"]
+        return result["value"]
+
+    def record_recovery(self, duration: float) -> None:
+        with self.lock:
+            self.recovery_times.append(duration)
+        self.logger.info(f"-> Recovered from a webdriver hang in {duration:.1f}s.")
+        self.log_stats()
+
+    def log_stats(self) -> None:
+        with self.lock:
+            hang_counts = dict(self.hang_counts)
+            recovery_times = list(self.recovery_times)
+        self.logger.info(
+            f"-> Webdriver hangs: {sum(hang_counts.values())}"
+            f" ({', '.join(f'{name} ×{count}' for name, count in sorted(hang_counts.items())) or 'none'});"
+            + (
+                f" recovery p50 {percentile(recovery_times, 50):.1f}s, max {max(recovery_times):.1f}s"
+                f" over the last {len(recovery_times)} recoveries."
+                if recovery_times else " no recoveries yet."
+            )
+        )
+
+
+class GuardedWebDriver:
+    def __init__(
+        self,
+        webdriver: Any,
+        watchdog: WebDriverWatchdog,
+        on_hang: Callable[[Any], None]
+    ):
+        self.webdriver = webdriver
+        self.watchdog = watchdog
+        self.on_hang = on_hang
+
+    def __getattr__(self, name: str) -> Any:
+        webdriver = self.webdriver
+        on_hang = lambda: self.on_hang(webdriver)
+        if callable(getattr(type(webdriver), name, None)):
+            method = getattr(webdriver, name)
+            return lambda *args, **kwargs: self.watchdog.call(name, lambda: method(*args, **kwargs), on_hang)
+        # Properties such as 'current_url' are remote calls too.
+        return self.watchdog.call(name, lambda: getattr(webdriver, name), on_hang)
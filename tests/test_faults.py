@@ -0,0 +1,47 @@
+import sys
+import unittest
+
+from os import path
+from requests import Session
+from requests.adapters import BaseAdapter
+from time import monotonic
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+
+from faults import Fault, FaultInjectingAdapter
+from standin import build_response
+
+
+class FixedBodyAdapter(BaseAdapter):
+    def __init__(self, body: bytes):
+        super().__init__()
+        self.body = body
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        return build_response(self, request, 200, {"Content-Type": "application/json"}, self.body)
+
+    def close(self) -> None:
+        pass
+
+
+class DripFaultTest(unittest.TestCase):
+    def test_drip_delivers_the_whole_body_slowly(self) -> None:
+        body = bytes(range(256)) * 4
+        adapter = FaultInjectingAdapter(FixedBodyAdapter(body), seed=0)
+        adapter.set_faults([Fault("drip", chunk_size=64, chunk_delay=0.02)])
+        session = Session()
+        session.mount("https://", adapter)
+
+        started_at = monotonic()
+        response = session.get("https://api.currys.co.uk/store/api/products/1")
+        elapsed = monotonic() - started_at
+
+        chunk_count = len(body) // 64
+        self.assertEqual(response.content, body)
+        self.assertEqual(adapter.injected_counts, {"drip": 1})
+        self.assertGreaterEqual(elapsed, chunk_count * 0.02)
+        self.assertLess(elapsed, (chunk_count + 1) * 0.02 + 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
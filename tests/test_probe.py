@@ -0,0 +1,73 @@
+import logging
+import sys
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from requests import Session
+from requests.adapters import HTTPAdapter
+from threading import Thread
+from urllib.parse import urlsplit
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "src"))
+
+from config import Config
+from probe import StockProbe
+
+
+class ProductHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    client_ports = []
+
+    def do_GET(self) -> None:
+        ProductHandler.client_ports.append(self.client_address[1])
+        if self.headers.get("If-None-Match") == '"1"':
+            self.send_response(304)
+            self.send_header("ETag", '"1"')
+            self.end_headers()
+            return
+        body = b'{"inStock": false}'
+        self.send_response(200)
+        self.send_header("ETag", '"1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class LocalAdapter(HTTPAdapter):
+    def __init__(self, port: int):
+        super().__init__()
+        self.port = port
+
+    def send(self, request, **kwargs):
+        request.url = f"http://127.0.0.1:{self.port}{urlsplit(request.url).path}"
+        return super().send(request, **kwargs)
+
+
+class StockProbeTest(unittest.TestCase):
+    def setUp(self) -> None:
+        ProductHandler.client_ports = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ProductHandler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.session = Session()
+        self.session.mount("https://", LocalAdapter(self.server.server_port))
+
+    def tearDown(self) -> None:
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_not_modified_probes_reuse_one_connection(self) -> None:
+        probe = StockProbe(self.session, Config.ProductInfo("Test", "1", 1), logger=logging.getLogger("Test"))
+        self.assertTrue(probe.probe())
+        for _ in range(3):
+            self.assertFalse(probe.probe())
+        self.assertEqual(len(ProductHandler.client_ports), 4)
+        self.assertEqual(len(set(ProductHandler.client_ports)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()